@@ -0,0 +1,182 @@
+import cv2
+import shutil
+import tempfile
+import numpy as np
+from pathlib import Path
+
+
+class TiledCanvas:
+    """Mosaic canvas split into fixed-size tiles backed by memory-mapped files
+
+    Tiles are created on first write, so memory use depends on the tile size and the
+    frames being drawn, not on the size of the whole mosaic. Their files live in a fresh
+    folder inside `directory` (the system temp folder by default) that close() deletes;
+    use the canvas as a context manager or call close() once it has been saved.
+    """
+
+    def __init__(self, width, height, channels=3, tile_size=4096, directory=None, dtype=np.uint8):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.tile_size = tile_size
+        self.dtype = dtype
+        if directory is not None:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+        self.directory = Path(tempfile.mkdtemp(prefix='mosaic_tiles_', dir=directory))
+        self.tiles = {}
+
+    @property
+    def shape(self):
+        return (self.height, self.width, self.channels)
+
+    def tile_bounds(self, row, col):
+        """Pixel bounds (x0, y0, x1, y1) of a tile on the canvas"""
+        x0, y0 = col * self.tile_size, row * self.tile_size
+        return x0, y0, min(x0 + self.tile_size, self.width), min(y0 + self.tile_size, self.height)
+
+    def tile(self, row, col):
+        """Memory-mapped tile array, created zero-filled on first access"""
+        if (row, col) not in self.tiles:
+            x0, y0, x1, y1 = self.tile_bounds(row, col)
+            self.tiles[(row, col)] = np.memmap(self.directory / f"tile_{row}_{col}.raw", dtype=self.dtype,
+                                               mode='w+', shape=(y1 - y0, x1 - x0, self.channels))
+        return self.tiles[(row, col)]
+
+    def tiles_in(self, x0, y0, x1, y1):
+        """(row, col) of every tile overlapping the given pixel rectangle"""
+        return [(row, col)
+                for row in range(max(y0, 0) // self.tile_size, (min(y1, self.height) - 1) // self.tile_size + 1)
+                for col in range(max(x0, 0) // self.tile_size, (min(x1, self.width) - 1) // self.tile_size + 1)]
+
+    def read_region(self, x0, y0, x1, y1):
+        """Copy a rectangle of the canvas into an in-memory array"""
+        region = np.zeros((y1 - y0, x1 - x0, self.channels), dtype=self.dtype)
+        for row, col in self.tiles_in(x0, y0, x1, y1):
+            if (row, col) not in self.tiles:
+                continue
+            tx0, ty0, tx1, ty1 = self.tile_bounds(row, col)
+            ix0, iy0, ix1, iy1 = max(x0, tx0), max(y0, ty0), min(x1, tx1), min(y1, ty1)
+            region[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = self.tiles[(row, col)][iy0 - ty0:iy1 - ty0,
+                                                                                  ix0 - tx0:ix1 - tx0]
+        return region
+
+    def iter_tiles(self):
+        """Yield (row, col, tile) for every tile that has been drawn on"""
+        for row, col in sorted(self.tiles):
+            yield row, col, self.tiles[(row, col)]
+
+    def overview(self, max_size=2000):
+        """Downscaled copy of the whole canvas for display"""
+        scale = min(1.0, max_size / max(self.width, self.height))
+        out = np.zeros((max(1, int(self.height * scale)), max(1, int(self.width * scale)), self.channels),
+                       dtype=self.dtype)
+        for row, col, tile in self.iter_tiles():
+            x0, y0, x1, y1 = self.tile_bounds(row, col)
+            ox0, oy0, ox1, oy1 = int(x0 * scale), int(y0 * scale), int(x1 * scale), int(y1 * scale)
+            if ox1 > ox0 and oy1 > oy0:
+                out[oy0:oy1, ox0:ox1] = cv2.resize(np.asarray(tile), (ox1 - ox0, oy1 - oy0),
+                                                   interpolation=cv2.INTER_AREA).reshape(oy1 - oy0, ox1 - ox0, -1)
+        return out
+
+    def save(self, output_path):
+        """Write each drawn tile next to output_path as <stem>_tiles/<row>_<col><suffix>"""
+        output_path = Path(output_path)
+        tile_dir = output_path.parent / f"{output_path.stem}_tiles"
+        tile_dir.mkdir(parents=True, exist_ok=True)
+        for row, col, tile in self.iter_tiles():
+            cv2.imwrite(str(tile_dir / f"{row}_{col}{output_path.suffix}"), np.asarray(tile))
+        return tile_dir
+
+    def flush(self):
+        for tile in self.tiles.values():
+            tile.flush()
+
+    def close(self):
+        """Release the tiles and delete their backing files"""
+        self.tiles.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MosaicCompositor:
+    def __init__(self, max_width=20000, max_height=20000, max_output_size=10000 * 10000,
+                 tile_size=4096, tile_directory=None):
+        # canvases over these limits are rendered into a TiledCanvas instead of one array
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_output_size = max_output_size  # modify for higher limit, jetson low
+        self.tile_size = tile_size
+        self.tile_directory = tile_directory
+
+    def frame_corners(self, shape, H):
+        """Corners of a frame of the given shape after applying H"""
+        rows, cols = shape[:2]
+        corners = np.float32([[0, 0], [0, rows], [cols, rows], [cols, 0]]).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(corners, H).reshape(-1, 2)
+
+    def canvas_bounds(self, shapes, transforms):
+        """Global canvas origin and size covering every transformed frame"""
+        points = np.concatenate([self.frame_corners(shape, H) for shape, H in zip(shapes, transforms)])
+        [x_min, y_min] = np.int32(points.min(axis=0) - 0.5)
+        [x_max, y_max] = np.int32(points.max(axis=0) + 0.5)
+        return int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)
+
+    def composite(self, frames, shapes, transforms):
+        """Warp each frame exactly once into one preallocated canvas
+
+        frames is any iterable yielding images in the same order as shapes and transforms,
+        so frames can be streamed instead of held in memory. Later frames are drawn on top.
+        Returns a numpy array, or a TiledCanvas when the mosaic exceeds the in-memory limits.
+        """
+        x_min, y_min, width, height = self.canvas_bounds(shapes, transforms)
+        tiled = width > self.max_width or height > self.max_height or width * height > self.max_output_size
+
+        print(f"Compositing {len(transforms)} frames into a {width}x{height} "
+              f"{'tiled ' if tiled else ''}canvas...")
+        canvas = None
+        for img, H in zip(frames, transforms):
+            if canvas is None:
+                channels = img.shape[2] if img.ndim == 3 else 1
+                if tiled:
+                    canvas = TiledCanvas(width, height, channels, self.tile_size, self.tile_directory, img.dtype)
+                else:
+                    canvas = np.zeros((height, width) + img.shape[2:], dtype=img.dtype)
+            if tiled:
+                self.paste_tiled(canvas, img, H, (x_min, y_min))
+            else:
+                self.paste(canvas, img, H, (x_min, y_min))
+        if tiled:
+            canvas.flush()
+        return canvas
+
+    def paste_tiled(self, canvas, img, H, origin=(0, 0)):
+        """Warp img into every tile its footprint touches"""
+        corners = self.frame_corners(img.shape, H) - np.float32(origin)
+        x0, y0 = np.int32(np.floor(corners.min(axis=0)))
+        x1, y1 = np.int32(np.ceil(corners.max(axis=0)))
+        for row, col in canvas.tiles_in(x0, y0, x1, y1):
+            tx0, ty0, _, _ = canvas.tile_bounds(row, col)
+            tile = canvas.tile(row, col)
+            self.paste(tile.reshape(tile.shape[:2]) if img.ndim == 2 else tile, img, H,
+                       (origin[0] + tx0, origin[1] + ty0))
+
+    def paste(self, canvas, img, H, origin=(0, 0)):
+        """Warp img by H into its footprint on the canvas, leaving other pixels untouched"""
+        corners = self.frame_corners(img.shape, H) - np.float32(origin)
+        x0, y0 = np.maximum(np.int32(np.floor(corners.min(axis=0))), 0)
+        x1, y1 = np.minimum(np.int32(np.ceil(corners.max(axis=0))), (canvas.shape[1], canvas.shape[0]))
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        # Only the footprint is resampled; BORDER_TRANSPARENT keeps what is already drawn outside the frame
+        H_roi = np.array([[1, 0, -origin[0] - x0],
+                          [0, 1, -origin[1] - y0],
+                          [0, 0, 1]]).dot(H)
+        roi = canvas[y0:y1, x0:x1]
+        cv2.warpPerspective(img, H_roi, (int(x1 - x0), int(y1 - y0)), dst=roi,
+                            borderMode=cv2.BORDER_TRANSPARENT)
@@ -1,72 +1,231 @@
 import os
+import json
 import time
 import shutil
+import signal
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from file_watcher import IGNORE_PATTERNS, StableFileWatcher, ignored
 
 class ResultsTransfer:
-    def __init__(self, source_folder='./results', destination_folder='D:/test_results', retry_delay=5):
+    def __init__(self, source_folder='./results', destination_folder='D:/test_results', retry_delay=5,
+                 workers=8, manifest_name='.transfer_manifest.json', chunk_size=8 << 20,
+                 ignore_patterns=IGNORE_PATTERNS):
         self.source_folder = Path(source_folder)
         self.destination_folder = Path(destination_folder)
         self.retry_delay = retry_delay
+        self.workers = workers
+        # copies are streamed in chunks of this size and resume from the last complete chunk
+        self.chunk_size = chunk_size
+        # size, mtime and sha256 of every transferred file, kept with the destination copy
+        self.manifest_path = self.destination_folder / manifest_name
+        # glob patterns of source files never copied, such as pyodm's <uuid>_<ts>_all.zip
+        self.ignore_patterns = tuple(ignore_patterns or ())
 
     def setup_destination(self):
         """Create destination folder if it doesn't exist"""
         os.makedirs(self.destination_folder, exist_ok=True)
 
+    def load_manifest(self):
+        """Manifest of previously transferred files keyed by relative path"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        """Write the manifest atomically so an interrupted run never leaves it half written"""
+        tmp_path = self.manifest_path.with_name(self.manifest_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def file_hash(path, chunk_size=1 << 20):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _transfer_one(self, src, dst, entry):
+        """Copy src unless the manifest shows the destination is current
+
+        Returns (status, manifest entry) where status is 'copied' or 'skipped'.
+        """
+        stat = src.stat()
+        dst_current = dst.exists() and dst.stat().st_size == stat.st_size
+        if entry and dst_current and entry['size'] == stat.st_size:
+            # Unchanged size and mtime: skip without reading the file
+            if entry['mtime_ns'] == stat.st_mtime_ns:
+                return 'skipped', entry
+            # Touched but possibly unchanged, compare content before copying
+            digest = self.file_hash(src)
+            if digest == entry['sha256']:
+                return 'skipped', dict(entry, mtime_ns=stat.st_mtime_ns)
+
+        os.makedirs(dst.parent, exist_ok=True)
+        digest = self._copy_with_retry(src, dst)
+        return 'copied', {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+
     def transfer_files(self):
-        """Transfer files individually with progress tracking"""
+        """Transfer new or changed files in parallel with progress tracking"""
         self.setup_destination()
-        
+
         try:
             # Get list of files to transfer
             files_to_copy = []
             for root, _, files in os.walk(self.source_folder):
                 for file in files:
+                    if ignored(file, self.ignore_patterns):
+                        continue
                     src_path = Path(root) / file
                     rel_path = src_path.relative_to(self.source_folder)
                     dst_path = self.destination_folder / rel_path
-                    files_to_copy.append((src_path, dst_path))
+                    files_to_copy.append((src_path, dst_path, rel_path.as_posix()))
 
             total_files = len(files_to_copy)
+            manifest = self.load_manifest()
             print(f"Starting transfer of {total_files} files...")
 
-            # Copy files individually
-            for idx, (src, dst) in enumerate(files_to_copy, 1):
-                try:
-                    # Create destination directory if needed
-                    os.makedirs(dst.parent, exist_ok=True)
-                    
-                    # Copy with retry logic
-                    self._copy_with_retry(src, dst)
-                    
-                    # Show progress
-                    print(f"Copied {idx}/{total_files}: {src.name}")
-                
-                except Exception as e:
-                    print(f"Error copying {src.name}: {e}")
-                    continue
-
-            print(f"Transfer completed to {self.destination_folder}")
+            # Copy files in a thread pool, file I/O releases the GIL
+            copied = skipped = 0
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(self._transfer_one, src, dst, manifest.get(key)): (src, key)
+                           for src, dst, key in files_to_copy}
+                for idx, future in enumerate(as_completed(futures), 1):
+                    src, key = futures[future]
+                    try:
+                        status, entry = future.result()
+                        manifest[key] = entry
+                        if status == 'copied':
+                            copied += 1
+                            # Show progress
+                            print(f"Copied {idx}/{total_files}: {src.name}")
+                        else:
+                            skipped += 1
+
+                    except Exception as e:
+                        print(f"Error copying {src.name}: {e}")
+                        continue
+
+            self.save_manifest(manifest)
+            print(f"Transfer completed to {self.destination_folder} ({copied} copied, {skipped} unchanged)")
             return True
 
         except Exception as e:
             print(f"Transfer failed: {e}")
             return False
 
-    def _copy_with_retry(self, src, dst, max_retries=3):
-        """Copy a single file with retry logic"""
+    def watch(self, stop_event=None, stable_seconds=5.0, poll_interval=1.0, idle_timeout=None):
+        """Copy files while they are still being produced
+
+        Each file under source_folder is copied once it has kept the same size and mtime for
+        stable_seconds, so transfer overlaps with ODM processing and download. Runs until
+        stop_event is set (or idle_timeout passes with no changes), then finishes with a
+        normal transfer_files pass to pick up anything that settled in the meantime.
+        """
+        self.setup_destination()
+        os.makedirs(self.source_folder, exist_ok=True)
+        watcher = StableFileWatcher(self.source_folder, stable_seconds, poll_interval,
+                                    ignore_patterns=self.ignore_patterns)
+        manifest = self.load_manifest()
+        print(f"Watching {self.source_folder} for finished files...")
+
+        def on_done(future, src, key):
+            try:
+                status, entry = future.result()
+                manifest[key] = entry
+                if status == 'copied':
+                    print(f"Copied: {src.name}")
+            except Exception as e:
+                print(f"Error copying {src.name}: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for src in watcher.watch(stop_event, idle_timeout):
+                rel_path = src.relative_to(self.source_folder)
+                key = rel_path.as_posix()
+                future = executor.submit(self._transfer_one, src, self.destination_folder / rel_path,
+                                         manifest.get(key))
+                future.add_done_callback(lambda f, src=src, key=key: on_done(f, src, key))
+
+        self.save_manifest(manifest)
+        return self.transfer_files()
+
+    def _copy_with_retry(self, src, dst, max_retries=5):
+        """Copy a single file with retry logic, returning the sha256 of the copied data
+
+        Data is written to <dst>.part and hashed as it streams. A failed attempt keeps the
+        partial file, so the next attempt (or the next run) resumes from the last complete
+        chunk instead of byte zero. The finished file is renamed into place atomically.
+        """
         for attempt in range(max_retries):
             try:
-                shutil.copy2(src, dst)
-                return True
-            except PermissionError as e:
+                return self._copy_chunked(src, dst)
+            except OSError as e:
+                if isinstance(e, FileNotFoundError) and not src.exists():
+                    raise  # the source is gone, e.g. a temporary file, waiting will not bring it back
+                # Locked files (WinError 32), permission errors and flaky external drives
                 if attempt < max_retries - 1:
-                    print(f"Permission error copying {src.name}, retrying in {self.retry_delay} seconds...")
+                    print(f"Error copying {src.name} ({e}), resuming in {self.retry_delay} seconds...")
                     time.sleep(self.retry_delay)
                 else:
                     raise
-        return False
+
+    def _copy_chunked(self, src, dst):
+        part_path = dst.with_name(dst.name + '.part')
+        state_path = dst.with_name(dst.name + '.part.json')
+        stat = src.stat()
+        source_state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        # Resume only if the partial copy was taken from this exact version of the source
+        offset = 0
+        try:
+            with open(state_path) as f:
+                if json.load(f) == source_state:
+                    partial_size = part_path.stat().st_size
+                    offset = min(partial_size, stat.st_size) // self.chunk_size * self.chunk_size
+        except (OSError, ValueError):
+            pass
+        if offset == 0:
+            with open(state_path, 'w') as f:
+                json.dump(source_state, f)
+
+        digest = hashlib.sha256()
+        with open(src, 'rb') as fsrc, open(part_path, 'r+b' if offset else 'wb') as fdst:
+            if offset:
+                print(f"Resuming {src.name} at {offset / (1 << 20):.0f} MB")
+                # The hash state is not persisted, so rebuild it from the chunks already written
+                for chunk in iter(lambda: fdst.read(min(self.chunk_size, offset - fdst.tell())), b''):
+                    digest.update(chunk)
+                fdst.truncate(offset)
+                fsrc.seek(offset)
+            for chunk in iter(lambda: fsrc.read(self.chunk_size), b''):
+                digest.update(chunk)
+                fdst.write(chunk)
+
+        shutil.copystat(src, part_path)
+        os.replace(part_path, dst)
+        os.remove(state_path)
+        return digest.hexdigest()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy ODM results to the destination drive")
+    parser.add_argument('--watch', action='store_true',
+                        help="copy files as they finish until interrupted (SIGINT/SIGTERM)")
+    parser.add_argument('--stable-seconds', type=float, default=5.0)
+    parser.add_argument('--idle-timeout', type=float, default=None)
+    args = parser.parse_args()
+
     transfer = ResultsTransfer()
-    transfer.transfer_files()
\ No newline at end of file
+    if args.watch:
+        stop_event = threading.Event()
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        transfer.watch(stop_event, stable_seconds=args.stable_seconds, idle_timeout=args.idle_timeout)
+    else:
+        transfer.transfer_files()
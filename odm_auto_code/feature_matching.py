@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+
+FLANN_INDEX_LSH = 6
+
+
+class FeatureMatcher:
+    """Match binary descriptors, returning index arrays instead of cv2.DMatch lists
+
+    method selects the backend:
+        'bf'         brute-force Hamming k=2 with the ratio test (most accurate)
+        'flann'      FLANN LSH index with the ratio test (fastest on large feature counts)
+        'crosscheck' brute-force Hamming keeping only mutual nearest neighbours
+    """
+
+    METHODS = ('bf', 'flann', 'crosscheck')
+
+    def __init__(self, method='bf', ratio=0.6):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown matcher '{method}', expected one of {', '.join(self.METHODS)}")
+        self.method = method
+        self.ratio = ratio
+        self.flann = None
+        if method == 'flann':
+            index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+            self.flann = cv2.FlannBasedMatcher(index_params, dict(checks=50))
+
+    def match(self, des_query, des_train):
+        """Indices (query_idx, train_idx) of the accepted matches"""
+        if des_query is None or des_train is None or len(des_query) < 2 or len(des_train) < 2:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        if self.method == 'flann':
+            return self._match_flann(des_query, des_train)
+        if self.method == 'crosscheck':
+            return self._match_crosscheck(des_query, des_train)
+        return self._match_bf(des_query, des_train)
+
+    def _match_bf(self, des_query, des_train):
+        # batchDistance gives the two nearest neighbours as arrays, without building DMatch objects
+        dist, nidx = cv2.batchDistance(des_query, des_train, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=2)
+        keep = (nidx[:, 1] >= 0) & (dist[:, 0] < self.ratio * dist[:, 1])
+        return np.flatnonzero(keep).astype(np.int32), nidx[keep, 0].astype(np.int32)
+
+    def _match_crosscheck(self, des_query, des_train):
+        dist, nidx = cv2.batchDistance(des_query, des_train, cv2.CV_32S, normType=cv2.NORM_HAMMING,
+                                       K=1, crosscheck=True)
+        keep = nidx[:, 0] >= 0
+        return np.flatnonzero(keep).astype(np.int32), nidx[keep, 0].astype(np.int32)
+
+    def _match_flann(self, des_query, des_train):
+        matches = self.flann.knnMatch(des_query, des_train, k=2)
+        pairs = np.array([(p[0].queryIdx, p[0].trainIdx, p[0].distance, p[1].distance)
+                          for p in matches if len(p) == 2], dtype=np.float32).reshape(-1, 4)
+        keep = pairs[:, 2] < self.ratio * pairs[:, 3]
+        return pairs[keep, 0].astype(np.int32), pairs[keep, 1].astype(np.int32)
@@ -0,0 +1,90 @@
+import os
+import time
+from fnmatch import fnmatch
+from pathlib import Path
+
+# Partial copies, temporary files, and the zip pyodm downloads (in .partN chunks when parallel) before extracting it
+IGNORE_PATTERNS = ('*.part', '*.tmp', '*.part.json', '*_all.zip', '*_all.zip.part*')
+
+
+def ignored(name, patterns=IGNORE_PATTERNS):
+    """True when a file name matches any of the glob patterns, case-insensitively"""
+    name = name.lower()
+    return any(fnmatch(name, pattern.lower()) for pattern in patterns)
+
+
+class StableFileWatcher:
+    """Poll a folder and report files once their size and mtime stop changing
+
+    Polling keeps this portable (Windows, Jetson, network drives) and a scan only stats
+    directory entries, so the cost per poll is small even for thousands of files. A file
+    is reported again if it changes after being reported.
+    """
+
+    def __init__(self, folder, stable_seconds=5.0, poll_interval=1.0, suffixes=None,
+                 ignore_patterns=IGNORE_PATTERNS):
+        self.folder = Path(folder)
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.suffixes = tuple(s.lower() for s in suffixes) if suffixes else None
+        self.ignore_patterns = tuple(ignore_patterns or ())  # glob patterns of file names never reported
+        self._pending = {}  # path -> (signature, time the signature was first seen)
+        self._reported = {}  # path -> signature when reported
+
+    def scan(self):
+        """Current (size, mtime_ns) of every matching file under the folder"""
+        found = {}
+        stack = [self.folder]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    name = entry.name.lower()
+                    if ignored(name, self.ignore_patterns):
+                        continue
+                    if self.suffixes and not name.endswith(self.suffixes):
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue  # removed while scanning
+                found[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+        return found
+
+    def poll(self):
+        """Files that became stable since the last poll, in path order"""
+        now = time.monotonic()
+        ready = []
+        current = self.scan()
+        for path, signature in current.items():
+            previous = self._pending.get(path)
+            if previous is None or previous[0] != signature:
+                self._pending[path] = (signature, now)
+            elif now - previous[1] >= self.stable_seconds and self._reported.get(path) != signature:
+                self._reported[path] = signature
+                ready.append(path)
+        for path in set(self._pending) - set(current):
+            del self._pending[path]
+            self._reported.pop(path, None)
+        return sorted(ready)
+
+    def watch(self, stop_event=None, idle_timeout=None):
+        """Yield files as they become stable until stop_event is set or nothing changes for idle_timeout seconds"""
+        last_activity = time.monotonic()
+        while stop_event is None or not stop_event.is_set():
+            ready = self.poll()
+            for path in ready:
+                yield path
+            if ready or any(self._reported.get(path) != sig for path, (sig, _) in self._pending.items()):
+                last_activity = time.monotonic()
+            elif idle_timeout is not None and time.monotonic() - last_activity >= idle_timeout:
+                return
+            if stop_event is not None:
+                stop_event.wait(self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
@@ -0,0 +1,117 @@
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+HASH_SIZE = 8  # 8x8 difference hash, 64 bits
+
+
+def frame_score(img_path):
+    """(sharpness, dhash) of one frame, None if it cannot be read
+
+    Both are computed on a 1/4 scale grayscale decode: sharpness is the variance of the
+    Laplacian, the hash compares neighbouring pixels of a 9x8 thumbnail.
+    """
+    img = cv2.imread(str(img_path), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        return None
+    sharpness = float(cv2.Laplacian(img, cv2.CV_32F).var())
+    thumb = cv2.resize(img, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    dhash = int(np.packbits(bits).view('>u8')[0])
+    return sharpness, dhash
+
+
+def hamming_distances(dhash, hashes):
+    """Bit differences between one hash and an array of uint64 hashes"""
+    diff = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(dhash))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class FrameFilter:
+    """Drop blurred frames and near-duplicates before stitching or upload
+
+    A frame is blurred when its sharpness is below min_sharpness or, with the default
+    relative threshold, below blur_ratio times the median sharpness of the set. Frames
+    whose hash is within duplicate_distance bits of one of the last `window` kept frames
+    are duplicates (hovering, slow passes); the sharper of the two is kept.
+    """
+
+    def __init__(self, blur_ratio=0.35, min_sharpness=None, duplicate_distance=4, window=8, workers=None):
+        self.blur_ratio = blur_ratio
+        self.min_sharpness = min_sharpness
+        self.duplicate_distance = duplicate_distance
+        self.window = window
+        self.workers = workers or os.cpu_count() or 1
+
+    def score(self, image_paths):
+        """frame_score for every path, decoded in a process pool"""
+        image_paths = list(image_paths)
+        chunksize = max(1, len(image_paths) // (4 * self.workers))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(frame_score, map(str, image_paths), chunksize=chunksize))
+
+    def select(self, image_paths, scores):
+        """(kept paths, {path: reason}) for frames in capture order and their scores"""
+        dropped = {}
+        valid = []
+        for path, score in zip(image_paths, scores):
+            if score is None:
+                dropped[path] = 'unreadable'
+            else:
+                valid.append((path, score))
+        if not valid:
+            return [], dropped
+
+        sharpness = np.array([s for _, (s, _) in valid])
+        threshold = self.min_sharpness
+        if threshold is None:
+            threshold = self.blur_ratio * float(np.median(sharpness))
+
+        kept = []  # (path, sharpness, hash)
+        for (path, (sharp, dhash)) in valid:
+            if sharp < threshold:
+                dropped[path] = 'blurred'
+                continue
+            recent = kept[-self.window:]
+            if recent and self.duplicate_distance is not None:
+                distances = hamming_distances(dhash, [h for _, _, h in recent])
+                nearest = int(np.argmin(distances))
+                if distances[nearest] <= self.duplicate_distance:
+                    k = len(kept) - len(recent) + nearest
+                    if sharp > kept[k][1]:
+                        dropped[kept[k][0]] = 'duplicate'
+                        kept[k] = (path, sharp, dhash)
+                    else:
+                        dropped[path] = 'duplicate'
+                    continue
+            kept.append((path, sharp, dhash))
+
+        return sorted(path for path, _, _ in kept), dropped
+
+    def filter(self, image_paths):
+        """Paths worth processing, sorted, with the reason each other frame was dropped"""
+        image_paths = sorted(image_paths)
+        kept, dropped = self.select(image_paths, self.score(image_paths))
+        reasons = {}
+        for reason in dropped.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        summary = ", ".join(f"{n} {reason}" for reason, n in sorted(reasons.items())) or "none dropped"
+        print(f"Kept {len(kept)} of {len(image_paths)} frames ({summary})")
+        return kept, dropped
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="List blurred and near-duplicate frames in a folder")
+    parser.add_argument('folder')
+    parser.add_argument('--blur-ratio', type=float, default=0.35)
+    parser.add_argument('--duplicate-distance', type=int, default=4)
+    args = parser.parse_args()
+
+    paths = [str(p) for p in Path(args.folder).glob('*') if p.suffix.lower() in ('.jpg', '.jpeg', '.png')]
+    kept, dropped = FrameFilter(args.blur_ratio, duplicate_distance=args.duplicate_distance).filter(paths)
+    for path, reason in sorted(dropped.items()):
+        print(f"{reason:10s} {Path(path).name}")
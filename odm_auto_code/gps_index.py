@@ -0,0 +1,100 @@
+import math
+import re
+import numpy as np
+from PIL import Image
+
+EARTH_RADIUS = 6378137.0  # meters, WGS84 equatorial radius
+GPS_IFD = 0x8825
+
+# DJI drones record height above the takeoff point in XMP, which is close to height above ground.
+# The EXIF GPS altitude is above sea level and says nothing about the footprint on its own.
+RELATIVE_ALTITUDE = re.compile(rb'RelativeAltitude="?([+-]?[0-9.]+)')
+
+
+def _dms_to_degrees(dms, ref):
+    degrees = float(dms[0]) + float(dms[1]) / 60.0 + float(dms[2]) / 3600.0
+    return -degrees if ref in ('S', 'W') else degrees
+
+
+def read_gps(img_path, ground_elevation=None):
+    """Read (latitude, longitude, altitude) from a drone JPEG, None if it has no GPS fix
+
+    altitude is the height above ground in meters: the XMP relative altitude when present,
+    else the GPS altitude less ground_elevation (meters above sea level) when that is given,
+    else None.
+    """
+    try:
+        with Image.open(img_path) as img:
+            gps = img.getexif().get_ifd(GPS_IFD)
+    except OSError:
+        return None
+    if 2 not in gps or 4 not in gps:
+        return None
+
+    lat = _dms_to_degrees(gps[2], gps.get(1, 'N'))
+    lon = _dms_to_degrees(gps[4], gps.get(3, 'E'))
+    alt = None
+    if 6 in gps and ground_elevation is not None:
+        # GPSAltitudeRef 1 means below sea level
+        above_sea = -float(gps[6]) if gps.get(5) in (1, b'\x01') else float(gps[6])
+        alt = above_sea - ground_elevation
+
+    with open(img_path, 'rb') as f:
+        match = RELATIVE_ALTITUDE.search(f.read(1 << 16))
+    if match:
+        alt = float(match.group(1))
+    return lat, lon, alt
+
+
+class FootprintIndex:
+    def __init__(self, fov_degrees=84.0, default_altitude=50.0, overlap_margin=1.0, max_candidates=8):
+        self.fov_degrees = fov_degrees  # diagonal field of view of the camera
+        self.default_altitude = default_altitude  # used for frames without a height above ground
+        self.overlap_margin = overlap_margin
+        self.max_candidates = max_candidates  # closest overlapping frames tried per frame
+
+    def footprints(self, positions):
+        """Local east/north centres in meters and footprint radii for (lat, lon, alt) positions"""
+        lat0 = math.radians(np.mean([p[0] for p in positions]))
+        lon0 = np.mean([p[1] for p in positions])
+        centres = np.array([[math.radians(lon - lon0) * EARTH_RADIUS * math.cos(lat0),
+                             math.radians(lat) * EARTH_RADIUS] for lat, lon, _ in positions])
+        altitudes = np.array([alt if alt is not None and alt > 0 else self.default_altitude
+                              for _, _, alt in positions])
+        radii = altitudes * math.tan(math.radians(self.fov_degrees) / 2)
+        return centres, radii
+
+    def candidate_pairs(self, positions):
+        """Pairs (i, j), i < j, of frames whose ground footprints overlap
+
+        positions holds (lat, lon, alt) per frame, or None for frames without GPS. Those
+        frames fall back to pairing with their neighbours in filename order.
+        """
+        located = [i for i, p in enumerate(positions) if p is not None]
+        pairs = set()
+        if len(located) > 1:
+            centres, radii = self.footprints([positions[i] for i in located])
+            cell_size = 2 * radii.max() * self.overlap_margin
+
+            # Hash footprints into a grid so each frame is only compared with nearby cells
+            grid = {}
+            cells = np.floor(centres / cell_size).astype(int)
+            for k, (cx, cy) in enumerate(cells):
+                grid.setdefault((cx, cy), []).append(k)
+
+            for k, (cx, cy) in enumerate(cells):
+                nearby = [n for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                          for n in grid.get((cx + dx, cy + dy), ()) if n != k]
+                if not nearby:
+                    continue
+                distances = np.linalg.norm(centres[nearby] - centres[k], axis=1)
+                reach = (radii[nearby] + radii[k]) * self.overlap_margin
+                overlapping = [(d, n) for d, n, r in zip(distances, nearby, reach) if d < r]
+                for _, n in sorted(overlapping)[:self.max_candidates]:
+                    i, j = located[k], located[n]
+                    pairs.add((min(i, j), max(i, j)))
+
+        for i in range(len(positions) - 1):
+            if positions[i] is None or positions[i + 1] is None:
+                pairs.add((i, i + 1))
+        return sorted(pairs)
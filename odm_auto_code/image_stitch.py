@@ -1,43 +1,632 @@
+import os
 import cv2
+import heapq
 import shutil
+import struct
 import numpy as np
 import matplotlib.pyplot as plt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from compositor import MosaicCompositor, TiledCanvas
+from feature_matching import FeatureMatcher
+from frame_filter import FrameFilter
+from gps_index import FootprintIndex, read_gps
+from instrumentation import StageRecorder
+from memory_budget import MemoryPlanner
+from tile_export import TileExporter
+
+
+def _jpeg_size(img_path):
+    """Read (width, height) from a JPEG header without decoding the image"""
+    try:
+        with open(img_path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                length = struct.unpack('>H', f.read(2))[0]
+                # SOF markers carry the frame size; C4, C8 and CC are not frame headers
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, 1)
+    except (OSError, struct.error):
+        return None
+
+
+def _load_image(img_path, max_size):
+    """Decode a single frame no larger than max_size, None if it cannot be read"""
+    flag = cv2.IMREAD_COLOR
+    size = _jpeg_size(img_path)
+    if max_size and size:
+        # Let libjpeg decode at 1/8, 1/4 or 1/2 scale when that still covers max_size
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) // factor >= max_size:
+                flag = reduced
+                break
+
+    img = cv2.imread(str(img_path), flag)
+    if img is not None and max_size:
+        # Resize image while maintaining aspect ratio
+        height, width = img.shape[:2]
+        if height > max_size or width > max_size:
+            scale = max_size / max(height, width)
+            new_size = (int(width * scale), int(height * scale))
+            img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _long_side(img_path, img):
+    """Longest side of the original frame, from the JPEG header when it can be read"""
+    size = _jpeg_size(img_path)
+    return max(size) if size else max(img.shape[:2])
+
+
+def _detect_features(orb, img):
+    """ORB keypoint positions and descriptors for one frame"""
+    kp, des = orb.detectAndCompute(img, None)
+    pts = np.float32([k.pt for k in kp]).reshape(-1, 2)
+    return pts, des
+
+
+def _match_features(matcher, feat1, feat2, min_matches, min_inliers=0, min_inlier_ratio=0.0):
+    """Homography taking frame 2 into frame 1 plus its inlier count, (None, n) on failure
+
+    Homographies with fewer than min_inliers RANSAC inliers, or fewer than min_inlier_ratio
+    of the matches, are rejected: barely overlapping pairs fit a few chance matches.
+    """
+    pts1, des1 = feat1
+    pts2, des2 = feat2
+    query_idx, train_idx = matcher.match(des2, des1)
+    if len(query_idx) <= min_matches:
+        return None, len(query_idx)
+
+    src_pts = pts2[query_idx].reshape(-1, 1, 2)
+    dst_pts = pts1[train_idx].reshape(-1, 1, 2)
+    # Nothing is seeded here: OpenCV's RANSAC starts from the same fixed internal RNG state on
+    # every call, so a pair gives the same homography in any pool worker
+    M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+    if M is None:
+        return None, 0
+    inliers = int(mask.sum())
+    if inliers < max(min_inliers, min_inlier_ratio * len(query_idx)):
+        return None, inliers
+    return M, inliers
+
+
+def _overlap_fraction(H, shape_i, shape_j):
+    """Share of the smaller frame covered by both once frame j is mapped into frame i by H"""
+    rows_i, cols_i = shape_i[:2]
+    rows_j, cols_j = shape_j[:2]
+    frame_i = np.float32([[0, 0], [cols_i, 0], [cols_i, rows_i], [0, rows_i]])
+    corners_j = np.float32([[0, 0], [cols_j, 0], [cols_j, rows_j], [0, rows_j]]).reshape(-1, 1, 2)
+    warped = cv2.perspectiveTransform(corners_j, H).reshape(-1, 2)
+    if not cv2.isContourConvex(warped):
+        return 0.0  # a folded or flipped footprint is no registration at all
+    area, _ = cv2.intersectConvexConvex(frame_i, warped)
+    return area / min(rows_i * cols_i, rows_j * cols_j)
+
+
+def _solve_affine(fixed, a, b, Q_a, Q_b, weight, initial, max_iterations=500):
+    """Affine maps M (count x 2 x 3) minimising sum(weight * |M_a q_a - M_b q_b|^2)
+
+    q_a and q_b are homogeneous rows of Q_a and Q_b. Frame fixed keeps its initial map.
+    Solved by conjugate gradients on the normal equations with a per-frame 3x3 preconditioner,
+    starting from initial so that only the remaining correction has to converge.
+    """
+    count = len(initial)
+
+    def gradient(residual):
+        g = np.zeros((count, 2, 3))
+        np.add.at(g, a, (weight[:, None] * residual)[:, :, None] * Q_a[:, None, :])
+        np.add.at(g, b, -(weight[:, None] * residual)[:, :, None] * Q_b[:, None, :])
+        g[fixed] = 0
+        return g
+
+    def residual(M):
+        return np.einsum('kij,kj->ki', M[a], Q_a) - np.einsum('kij,kj->ki', M[b], Q_b)
+
+    blocks = np.zeros((count, 3, 3))
+    np.add.at(blocks, a, weight[:, None, None] * Q_a[:, :, None] * Q_a[:, None, :])
+    np.add.at(blocks, b, weight[:, None, None] * Q_b[:, :, None] * Q_b[:, None, :])
+    inverse = np.linalg.inv(blocks + 1e-9 * np.eye(3))
+
+    def precondition(g):
+        return np.einsum('kij,klj->kli', inverse, g)
+
+    M = np.array(initial, dtype=np.float64)
+    r = -gradient(residual(M))
+    z = precondition(r)
+    d = z.copy()
+    rz = np.sum(r * z)
+    tolerance = 1e-14 * max(rz, 1.0)
+    for _ in range(max_iterations):
+        if rz <= tolerance:
+            break
+        Ad = gradient(residual(d))
+        step = rz / np.sum(d * Ad)
+        M += step * d
+        r -= step * Ad
+        z = precondition(r)
+        rz_next = np.sum(r * z)
+        d = z + (rz_next / rz) * d
+        rz = rz_next
+    return M
+
+
+# Per-process ORB detector and matcher used by the feature pool
+_worker_orb = None
+_worker_matcher = None
+
+
+def _init_feature_worker(nfeatures, matcher_method, ratio):
+    global _worker_orb, _worker_matcher
+    cv2.setNumThreads(1)  # parallelism comes from the pool, avoid oversubscribing cores
+    _worker_orb = cv2.ORB_create(nfeatures=nfeatures, scaleFactor=1.2, nlevels=8)
+    _worker_matcher = FeatureMatcher(matcher_method, ratio)
+
+
+def _extract_worker(args):
+    img_path, max_size = args
+    img = _load_image(img_path, max_size)
+    if img is None:
+        return None
+    return _detect_features(_worker_orb, img), img.shape, _long_side(img_path, img)
+
+
+def _match_worker(args):
+    return _match_features(_worker_matcher, *args)
 
 
 class ImageStitcher:
-    def __init__(self, nfeatures=5000, min_matches=5, distance_threshold=0.6):
+    def __init__(self, nfeatures=5000, min_matches=5, distance_threshold=0.6, mode='chained',
+                 load_workers=None, workers=None, use_gps=True, max_size=2000, registration_size=None,
+                 matcher='bf', memory_budget=None, min_inliers=15, min_inlier_ratio=0.2, min_overlap=0.25,
+                 recorder=None):
+        self.nfeatures = nfeatures
         self.orb = cv2.ORB_create(nfeatures=nfeatures, scaleFactor=1.2, nlevels=8)
         self.min_matches = min_matches
+        # pair homographies below these are dropped in the chained and hierarchical modes
+        self.min_inliers = min_inliers
+        self.min_inlier_ratio = min_inlier_ratio
+        # and so are pairs whose homography overlaps less than this share of a frame
+        self.min_overlap = min_overlap
         self.distance_threshold = distance_threshold
+        # 'bf', 'flann' or 'crosscheck', see FeatureMatcher
+        self.matcher = FeatureMatcher(matcher, distance_threshold)
+        # 'mosaic' matches each frame against the growing mosaic,
+        # 'chained' matches cached per-frame features against neighbouring frames,
+        # 'hierarchical' registers those matches by merging adjacent groups up a balanced tree
+        self.mode = mode
+        self.load_workers = load_workers or min(8, os.cpu_count() or 1)
+        # processes used for feature extraction and matching, 1 keeps everything in-process
+        self.workers = workers or os.cpu_count() or 1
+        # frames are matched at registration_size and rendered at max_size (None keeps full resolution)
+        self.max_size = max_size
+        self.registration_size = registration_size or max_size
+        # pair frames by overlapping GPS footprints instead of only by filename order
+        self.use_gps = use_gps
+        self.footprint_index = FootprintIndex()
+        self.image_paths = []
+        self.features = []
+        self.transforms = []
+        self.reference = None  # frame the transforms map into, set by chain_ and tree_homographies
+        self.compositor = MosaicCompositor()
+        # resolution, tiling and parallelism are planned to fit memory_budget bytes ('6G' works too),
+        # by default a share of the RAM available at startup
+        self.planner = MemoryPlanner(memory_budget)
+        # per-stage wall time, CPU time and peak RSS, see instrumentation.StageRecorder
+        self.recorder = recorder or StageRecorder()
         self.result = None
 
-    def load_images(self, folder_path, max_size=2000):
+    def image_files(self, folder_path):
+        """Sorted list of frames in the folder, or of an explicit list of frame paths"""
+        if isinstance(folder_path, (list, tuple)):
+            return sorted(Path(p) for p in folder_path)
+        return sorted(Path(folder_path).glob("*.jpg"))
+
+    def iter_images(self, paths, max_size=2000, workers=None):
+        """Decode frames in a thread pool, yielding (path, image) in order
+
+        Only a small window of frames is decoded ahead of the consumer, so peak memory
+        does not grow with the number of frames.
+        """
+        workers = workers or self.load_workers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for img_path in paths:
+                pending.append((img_path, executor.submit(_load_image, img_path, max_size)))
+                if len(pending) >= 2 * workers:
+                    img_path, future = pending.popleft()
+                    yield img_path, future.result()
+            while pending:
+                img_path, future = pending.popleft()
+                yield img_path, future.result()
+
+    def load_images(self, folder_path, max_size=None):
         """Load and resize images from specified folder"""
-        path = sorted(Path(folder_path).glob("*.jpg"))
+        max_size = max_size or self.max_size
+        paths = self.image_files(folder_path)
+        frame_size = _jpeg_size(paths[0]) if paths else None
+        if frame_size:
+            max_size = self.planner.load_plan(len(paths), frame_size, max_size)
         img_list = []
-        
+
         print("Loading and resizing images...")
-        for img_path in path:
-            img = cv2.imread(str(img_path))
-            if img is not None:
-                # Resize image while maintaining aspect ratio
-                height, width = img.shape[:2]
-                if height > max_size or width > max_size:
-                    scale = max_size / max(height, width)
-                    new_size = (int(width * scale), int(height * scale))
-                    img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
-                img_list.append(img)
-                print(f"Loaded and processed: {img_path.name}")
-            
+        with self.recorder.stage('load') as info:
+            for img_path, img in self.iter_images(paths, max_size):
+                if img is not None:
+                    img_list.append(img)
+                    print(f"Loaded and processed: {img_path.name}")
+            info['frames'] = len(img_list)
+
         if len(img_list) < 2:
             raise ValueError("At least 2 images required for stitching")
         return img_list
 
+    def detect_features(self, img):
+        """Detect ORB features once for a source frame"""
+        return _detect_features(self.orb, img)
+
+    def match_features(self, feat1, feat2):
+        """Estimate the homography mapping frame 2 into frame 1 from cached features"""
+        return _match_features(self.matcher, feat1, feat2, self.min_matches, self.min_inliers,
+                               self.min_inlier_ratio)
+
+    def feature_pool(self):
+        """Process pool for extraction and matching, or a null context when running in-process"""
+        if self.workers > 1:
+            return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_feature_worker,
+                                       initargs=(self.nfeatures, self.matcher.method, self.matcher.ratio))
+        return nullcontext(None)
+
+    def extract_features(self, paths, executor=None):
+        """Features of every readable frame at registration size
+
+        Returns (paths, features, shapes, long_sides) in input order, where long_sides holds
+        the longest side of each original frame.
+        """
+        if executor is not None:
+            chunksize = max(1, len(paths) // (4 * self.workers))
+            results = executor.map(_extract_worker, [(p, self.registration_size) for p in paths],
+                                   chunksize=chunksize)
+        else:
+            results = ((self.detect_features(img), img.shape, _long_side(img_path, img)) if img is not None else None
+                       for img_path, img in self.iter_images(paths, self.registration_size))
+
+        kept_paths, features, shapes, long_sides = [], [], [], []
+        for img_path, result in zip(paths, results):
+            if result is not None:
+                kept_paths.append(img_path)
+                features.append(result[0])
+                shapes.append(result[1])
+                long_sides.append(result[2])
+                print(f"Loaded and processed: {img_path.name}")
+        return kept_paths, features, shapes, long_sides
+
+    def render_scales(self, shapes, long_sides):
+        """Per-frame factor from registration resolution to rendering resolution"""
+        scales = []
+        for shape, long_side in zip(shapes, long_sides):
+            render_long = min(self.max_size, long_side) if self.max_size else long_side
+            scales.append(render_long / max(shape[:2]))
+        return scales
+
+    def scale_transforms(self, transforms, scales, reference):
+        """Rescale registration-resolution transforms to act on rendering-resolution frames
+
+        A frame at rendering resolution is taken back to registration resolution, through
+        its transform, then up to the reference frame's rendering resolution.
+        """
+        ref_scale = np.diag([scales[reference], scales[reference], 1.0])
+        return [None if T is None else ref_scale.dot(T).dot(np.diag([1.0 / s, 1.0 / s, 1.0]))
+                for T, s in zip(transforms, scales)]
+
+    def match_pairs(self, pairs, executor=None, warn=True):
+        """Match frame pairs, returning {(i, j): (H, inliers)} for the pairs that registered
+
+        Results are gathered in the order of pairs, so they do not depend on the pool size.
+        """
+        jobs = [(self.features[i], self.features[j], self.min_matches, self.min_inliers, self.min_inlier_ratio)
+                for i, j in pairs]
+        if executor is not None:
+            chunksize = max(1, len(jobs) // (4 * self.workers))
+            results = executor.map(_match_worker, jobs, chunksize=chunksize)
+        else:
+            results = (_match_features(self.matcher, *job) for job in jobs)
+
+        pair_homographies = {}
+        for (i, j), (H, inliers) in zip(pairs, results):
+            if H is not None:
+                pair_homographies[(i, j)] = (H, inliers)
+            elif warn:
+                print(f"Warning: No homography between frames {i} and {j}")
+        return pair_homographies
+
+    def overlapping_pairs(self, pair_homographies, shapes):
+        """The registered pairs whose homography overlaps the frames by at least min_overlap
+
+        Frames that only share a strip fit their homography to matches along one edge, and it
+        extrapolates badly across the rest of the frame.
+        """
+        return {(i, j): match for (i, j), match in pair_homographies.items()
+                if _overlap_fraction(match[0], shapes[i], shapes[j]) >= self.min_overlap}
+
+    def candidate_pairs(self):
+        """Frame pairs worth matching: overlapping GPS footprints, else filename neighbours"""
+        sequential = [(i, i + 1) for i in range(len(self.image_paths) - 1)]
+        if not self.use_gps:
+            return sequential
+
+        positions = [read_gps(p) for p in self.image_paths]
+        if sum(p is not None for p in positions) < 2:
+            print("No GPS tags found, pairing frames by filename order")
+            return sequential
+
+        pairs = self.footprint_index.candidate_pairs(positions)
+        print(f"{len(pairs)} candidate pairs from GPS footprints")
+        return pairs
+
+    def reference_frame(self, num_frames, pair_homographies):
+        """Middle frame of the largest group of frames linked by pair_homographies
+
+        The middle keeps the chains short in both directions, and taking it from the largest
+        connected group means one unmatched frame cannot leave the rest of the map out.
+        """
+        neighbours = {i: [] for i in range(num_frames)}
+        for i, j in pair_homographies:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+        best, seen = [], set()
+        for start in range(num_frames):
+            if start in seen:
+                continue
+            component, stack = [], [start]
+            seen.add(start)
+            while stack:
+                i = stack.pop()
+                component.append(i)
+                for j in neighbours[i]:
+                    if j not in seen:
+                        seen.add(j)
+                        stack.append(j)
+            if len(component) > len(best):
+                best = component
+        if num_frames // 2 in best:
+            return num_frames // 2
+        return sorted(best)[len(best) // 2]
+
+    def chain_homographies(self, num_frames, pair_homographies, reference=None):
+        """Chain pairwise homographies into one reference frame
+
+        pair_homographies maps (i, j) to (H, inliers) where H takes frame j into frame i.
+        Frames are joined along a maximum spanning tree of inlier counts (Prim's algorithm),
+        so each frame is reached through the strongest links available rather than whichever
+        link happens to reach it first.
+        Returns one 3x3 transform per frame, None for frames that could not be connected.
+        """
+        if reference is None:
+            reference = self.reference_frame(num_frames, pair_homographies)
+        self.reference = reference
+
+        neighbours = {i: [] for i in range(num_frames)}
+        for (i, j), (H, inliers) in pair_homographies.items():
+            neighbours[i].append((inliers, j, H))
+            neighbours[j].append((inliers, i, np.linalg.inv(H)))
+
+        transforms = [None] * num_frames
+        transforms[reference] = np.eye(3)
+        heap = []
+        count = 0  # tie-breaker so the heap never compares matrices
+        i = reference
+        while True:
+            for inliers, j, H_ji in neighbours[i]:
+                if transforms[j] is None:
+                    heapq.heappush(heap, (-inliers, count, i, j, H_ji))
+                    count += 1
+            # Strongest link from the tree to a frame outside it
+            while heap and transforms[heap[0][3]] is not None:
+                heapq.heappop(heap)
+            if not heap:
+                break
+            _, _, parent, i, H_ji = heapq.heappop(heap)
+            # H_ji takes frame i into its parent
+            transforms[i] = transforms[parent].dot(H_ji)
+        return transforms
+
+    def refine_transforms(self, transforms, pair_homographies, shapes, reference, iterations=3):
+        """Refit the transforms so they agree with every registered pair at once
+
+        A spanning tree uses one link per frame and ignores the rest, and composing its
+        homographies lets small perspective errors grow along each branch until frames far
+        from the reference are visibly bent. Instead every frame gets an affine map into the
+        reference, fitted by weighted least squares to points sampled where each registered
+        pair overlaps. Nadir frames over flat ground differ by little more than an affine
+        map, and the fit stays linear. Pairs that disagree with the fit are dropped and
+        the fit is repeated.
+        """
+        placed = [i for i, T in enumerate(transforms) if T is not None]
+        index = {f: k for k, f in enumerate(placed)}
+
+        # Points of frame j that land inside frame i, in the coordinates of both frames
+        samples = []
+        for (i, j), (H, inliers) in pair_homographies.items():
+            if i not in index or j not in index:
+                continue
+            rows_j, cols_j = shapes[j][:2]
+            grid = np.float32([[x, y] for y in np.linspace(0, rows_j, 5)
+                               for x in np.linspace(0, cols_j, 5)]).reshape(-1, 1, 2)
+            in_i = cv2.perspectiveTransform(grid, H).reshape(-1, 2)
+            rows_i, cols_i = shapes[i][:2]
+            inside = (in_i[:, 0] >= 0) & (in_i[:, 0] <= cols_i) & (in_i[:, 1] >= 0) & (in_i[:, 1] <= rows_i)
+            if inside.sum() >= 3:
+                samples.append((index[i], index[j], in_i[inside], grid.reshape(-1, 2)[inside], np.sqrt(inliers)))
+        if not samples:
+            return transforms
+
+        a = np.concatenate([np.full(len(s[2]), s[0]) for s in samples])
+        b = np.concatenate([np.full(len(s[3]), s[1]) for s in samples])
+        pair_of = np.concatenate([np.full(len(s[2]), n) for n, s in enumerate(samples)])
+        weight = np.concatenate([np.full(len(s[2]), s[4]) for s in samples])
+        # Coordinates in units of the frame size keep the least-squares problem well conditioned
+        unit = float(max(max(shapes[f][:2]) for f in placed))
+        normalise = np.diag([1 / unit, 1 / unit, 1.0])
+        Q_a = np.hstack([np.concatenate([s[2] for s in samples]) / unit, np.ones((len(a), 1))])
+        Q_b = np.hstack([np.concatenate([s[3] for s in samples]) / unit, np.ones((len(b), 1))])
+
+        # The chained transforms, reduced to affine maps, are the starting point
+        corners = np.float64([[0, 0], [1, 0], [0, 1], [1, 1], [0.5, 0.5]])
+        maps = []
+        for f in placed:
+            rows, cols = shapes[f][:2]
+            local = corners * [cols / unit, rows / unit]
+            T = normalise.dot(transforms[f]).dot(np.linalg.inv(normalise))
+            mapped = cv2.perspectiveTransform(local.reshape(-1, 1, 2), T).reshape(-1, 2)
+            maps.append(np.linalg.lstsq(np.hstack([local, np.ones((5, 1))]), mapped, rcond=None)[0].T)
+        maps[index[reference]] = np.eye(3)[:2]
+
+        active = np.ones(len(samples), bool)
+        for _ in range(iterations):
+            maps = _solve_affine(index[reference], a, b, Q_a, Q_b, weight * active[pair_of], maps)
+            error = np.linalg.norm(np.einsum('kij,kj->ki', maps[a], Q_a) - np.einsum('kij,kj->ki', maps[b], Q_b),
+                                   axis=1) * unit
+            rms = np.sqrt(np.bincount(pair_of, error ** 2) / np.bincount(pair_of))
+            # a pair well outside the typical misfit is a wrong match, not error to spread out
+            keep = rms <= max(3 * np.median(rms[active]), 2.0)
+            if keep[active].all():
+                break
+            active &= keep
+
+        refined = list(transforms)
+        for f, k in index.items():
+            refined[f] = np.linalg.inv(normalise).dot(np.vstack([maps[k], [0, 0, 1]])).dot(normalise)
+        return refined
+
+    def merge_groups(self, group_a, group_b, pair_homographies, shapes):
+        """Homography taking group b's reference frame into group a's, None if no pair links them
+
+        A group maps each of its frames into the group's reference frame. Every matched pair
+        between the two groups gives a 3x3 grid of corresponding points in both references,
+        and one homography is fitted to all of them, so a single bad link cannot bend the merge.
+        """
+        src, dst = [], []
+        for (i, j), (H, _) in pair_homographies.items():
+            if i in group_a and j in group_b:
+                a, b, H_ab = i, j, H
+            elif j in group_a and i in group_b:
+                a, b, H_ab = j, i, np.linalg.inv(H)
+            else:
+                continue
+            rows, cols = shapes[b][:2]
+            grid = np.float32([[x, y] for y in (0, rows / 2, rows) for x in (0, cols / 2, cols)]).reshape(-1, 1, 2)
+            src.append(cv2.perspectiveTransform(grid, group_b[b]))
+            dst.append(cv2.perspectiveTransform(grid, group_a[a].dot(H_ab)))
+        if not src:
+            return None
+
+        threshold = 0.02 * max(max(shapes[f][:2]) for f in group_b)
+        H, _ = cv2.findHomography(np.concatenate(src), np.concatenate(dst), cv2.RANSAC, threshold)
+        return H
+
+    def cross_pairs(self, group_a, group_b, H, shapes, tried, reach=0.6):
+        """Untried frame pairs across two groups whose footprints overlap once b is joined to a by H
+
+        Frames count as overlapping when their centres are closer than reach times the longer
+        frame side, which takes in diagonal neighbours on adjacent flight lines.
+        """
+        def centre(f, T):
+            rows, cols = shapes[f][:2]
+            return cv2.perspectiveTransform(np.float32([[[cols / 2, rows / 2]]]), T)[0, 0]
+
+        centres_a = {a: centre(a, T) for a, T in group_a.items()}
+        pairs = []
+        for b, T in group_b.items():
+            centre_b = centre(b, H.dot(T))
+            for a, centre_a in centres_a.items():
+                pair = (min(a, b), max(a, b))
+                limit = reach * max(shapes[a][:2] + shapes[b][:2])
+                if pair not in tried and np.linalg.norm(centre_b - centre_a) < limit:
+                    pairs.append(pair)
+        return sorted(pairs)
+
+    def tree_homographies(self, num_frames, pair_homographies, shapes, reference=None, executor=None):
+        """Register frames by merging adjacent groups pairwise up a balanced tree
+
+        Every frame reaches the root through about log2(num_frames) merges instead of a chain
+        of up to num_frames / 2 pairwise homographies, so drift stays small on long strips.
+        At each merge the groups are first joined through the pairs already matched, then every
+        other pair of frames that overlaps across the join is matched too and the join is refitted
+        to all of them, so groups covering neighbouring flight lines are tied together along the
+        whole seam. The pairs across all joins of a level are matched in one batch, in the
+        feature pool when an executor is given, so the workers stay busy on every level.
+        Returns one 3x3 transform per frame into the reference frame, like chain_homographies,
+        None for frames outside the largest group that could be merged.
+        """
+        if reference is None:
+            reference = self.reference_frame(num_frames, pair_homographies)
+        pair_homographies = dict(pair_homographies)
+        tried = set(pair_homographies)
+
+        groups = [{i: np.eye(3)} for i in range(num_frames)]
+        offset = 0
+        while len(groups) > 1:
+            # Join each adjacent pair of groups through the pairs matched so far
+            joins = []
+            for k in range(offset, len(groups) - 1, 2):
+                group_a, group_b = groups[k], groups[k + 1]
+                H = self.merge_groups(group_a, group_b, pair_homographies, shapes)
+                pairs = self.cross_pairs(group_a, group_b, H, shapes, tried) if H is not None else []
+                tried.update(pairs)
+                joins.append((group_a, group_b, H, pairs))
+
+            # The overlapping pairs across every join on this level go to the pool in one batch
+            found = self.overlapping_pairs(
+                self.match_pairs([pair for join in joins for pair in join[3]], executor, warn=False), shapes)
+            pair_homographies.update(found)
+
+            merged = groups[:offset]
+            progress = False
+            for group_a, group_b, H, pairs in joins:
+                if H is not None and any(pair in found for pair in pairs):
+                    H = self.merge_groups(group_a, group_b, pair_homographies, shapes)
+                if H is None:
+                    merged.extend([group_a, group_b])
+                else:
+                    group_a.update((f, H.dot(T)) for f, T in group_b.items())
+                    merged.append(group_a)
+                    progress = True
+            if (len(groups) - offset) % 2:
+                merged.append(groups[-1])
+            groups = merged
+            if progress:
+                offset = 0
+            elif offset == 0:
+                offset = 1  # a gap between pairs, try pairing each group with its other neighbour
+            else:
+                break
+
+        root = max(groups, key=len)
+        if reference not in root:
+            reference = sorted(root)[len(root) // 2]
+        self.reference = reference
+        to_reference = np.linalg.inv(root[reference])
+        return [to_reference.dot(root[i]) if i in root else None for i in range(num_frames)]
+
     def stitch_images(self, folder_path):
         """Main stitching process"""
+        if self.mode in ('chained', 'hierarchical'):
+            return self._stitch_chained(folder_path)
+
         img_list = self.load_images(folder_path)
         print(f"Processing {len(img_list)} images...")
+        # the warp holds the mosaic, the warped copy and its mask at once
+        self.compositor.max_output_size = self.planner.budget // (3 * 3)
 
         while len(img_list) > 1:
             img1 = img_list.pop(0)
@@ -45,41 +634,126 @@ class ImageStitcher:
 
             # Extract features
             #self.sift = cv2.SIFT_create()
-            kp1, des1 = self.orb.detectAndCompute(img1, None)
-            kp2, des2 = self.orb.detectAndCompute(img2, None)
+            with self.recorder.stage('detect'):
+                pts1, des1 = self.detect_features(img1)
+                pts2, des2 = self.detect_features(img2)
 
             if des1 is None or des2 is None:
                 print("Warning: No features detected in one or both images")
                 continue
 
-            bf = cv2.BFMatcher_create(cv2.NORM_HAMMING)
-            matches = bf.knnMatch(des1, des2, k=2)
+            # Match and apply the ratio test
+            with self.recorder.stage('match'):
+                query_idx, train_idx = self.matcher.match(des1, des2)
 
-            # Filter good matches
-            good = []
-            for m, n in matches:
-                if m.distance < self.distance_threshold * n.distance:  # Apply ratio test
-                    good.append(m)
-
-            if len(good) > self.min_matches:
+            if len(query_idx) > self.min_matches:
                 # Get matching points
-                src_pts = np.float32([kp1[m.queryIdx].pt for m in good]).reshape(-1, 1, 2) #Reshaping Images to be Compatible
-                dst_pts = np.float32([kp2[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+                src_pts = pts1[query_idx].reshape(-1, 1, 2) #Reshaping Images to be Compatible
+                dst_pts = pts2[train_idx].reshape(-1, 1, 2)
 
                 # Calculate homography
-                M, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+                with self.recorder.stage('homography'):
+                    M, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
                 
                 # Warp and combine images
                 if M is not None:
-                    result = self.warp_images(img2, img1, M)
+                    with self.recorder.stage('warp'):
+                        result = self.warp_images(img2, img1, M)
+                    if result is None:
+                        # Dropping the frame would silently truncate the mosaic, composite it in tiles instead
+                        print("Mosaic outgrew the memory limits, stitching again in chained mode")
+                        img_list.clear()
+                        return self._stitch_chained(folder_path)
                     img_list.insert(0, result)
                 else:
                     print("Warning: Homography could not be computed. Skipping this pair.")
 
             if len(img_list) == 1:
-                self.result = cv2.cvtColor(img_list[0], cv2.COLOR_BGR2RGB)
+                self.result = img_list[0]
                 break
 
+    def _stitch_chained(self, folder_path):
+        """Stitch using per-frame cached features and chained or tree-merged homographies
+
+        Frames are streamed twice, once for features and once for compositing, so only
+        the cached features and not the decoded images are held for the whole run.
+        """
+        paths = self.image_files(folder_path)
+        frame_size = _jpeg_size(paths[0]) if paths else None
+        if frame_size:
+            self.registration_size, self.workers = self.planner.registration_plan(
+                len(paths), frame_size, self.nfeatures, self.registration_size, self.workers)
+
+        print("Loading images and extracting features...")
+        with self.feature_pool() as executor:
+            # Frames are decoded inside the feature workers, so 'detect' includes loading
+            with self.recorder.stage('detect') as info:
+                self.image_paths, self.features, shapes, long_sides = self.extract_features(paths, executor)
+                info['frames'] = len(self.image_paths)
+
+            num_frames = len(self.image_paths)
+            if num_frames < 2:
+                raise ValueError("At least 2 images required for stitching")
+            print(f"Processing {num_frames} images...")
+
+            pairs = self.candidate_pairs()
+            with self.recorder.stage('match', pairs=len(pairs)) as info:
+                pair_homographies = self.overlapping_pairs(self.match_pairs(pairs, executor), shapes)
+                info['registered'] = len(pair_homographies)
+
+            # Hierarchical merges match more pairs across each join, so they run inside the pool
+            with self.recorder.stage('homography', mode=self.mode):
+                if self.mode == 'hierarchical':
+                    self.transforms = self.tree_homographies(num_frames, pair_homographies, shapes,
+                                                             executor=executor)
+                else:
+                    self.transforms = self.chain_homographies(num_frames, pair_homographies)
+                    self.transforms = self.refine_transforms(self.transforms, pair_homographies, shapes,
+                                                             self.reference)
+
+        # Frames nearest the reference are drawn last so they stay on top, as with the mosaic fold
+        reference = self.reference
+        order = sorted((i for i, T in enumerate(self.transforms) if T is not None),
+                       key=lambda i: -abs(i - reference))
+        skipped = num_frames - len(order)
+        if skipped:
+            print(f"Warning: {skipped} frame(s) could not be connected and were skipped")
+
+        # Homographies were estimated on registration-size proxies, rendering may use larger frames
+        transforms = self.transforms
+        if self.registration_size != self.max_size:
+            scales = self.render_scales(shapes, long_sides)
+            transforms = self.scale_transforms(self.transforms, scales, reference)
+            shapes = [(int(round(shape[0] * s)), int(round(shape[1] * s))) + tuple(shape[2:])
+                      for shape, s in zip(shapes, scales)]
+
+        # Fit the canvas to the memory budget: in memory, tiled to disk, or at a lower resolution
+        with self.recorder.stage('plan') as info:
+            _, _, width, height = self.compositor.canvas_bounds([shapes[i] for i in order],
+                                                                [transforms[i] for i in order])
+            largest = max((shapes[i] for i in order), key=lambda shape: shape[0] * shape[1])
+            plan = self.planner.render_plan(width, height, largest, self.load_workers)
+            info.update(plan)
+        self.compositor.max_output_size = plan['max_output_size']
+        self.compositor.tile_size = plan['tile_size']
+        render_size = self.max_size
+        if plan['scale'] < 1:
+            s = plan['scale']
+            print(f"Memory budget {self.planner.budget >> 20} MB: rendering at {s:.0%} resolution")
+            S = np.diag([s, s, 1.0])
+            transforms = [None if T is None else S.dot(T).dot(np.linalg.inv(S)) for T in transforms]
+            shapes = [(int(round(shape[0] * s)), int(round(shape[1] * s))) + tuple(shape[2:]) for shape in shapes]
+            render_size = max(max(shapes[i][:2]) for i in order)
+
+        frames = (img for _, img in self.iter_images([self.image_paths[i] for i in order], render_size,
+                                                     plan['load_workers']))
+        with self.recorder.stage('warp', frames=len(order)):
+            mosaic = self.compositor.composite(frames,
+                                               [shapes[i] for i in order],
+                                               [transforms[i] for i in order])
+        # Kept in OpenCV's BGR order, so saving and tiling need no full-canvas conversion
+        self.result = mosaic
+
     def warp_images(self, img1, img2, H):
         rows1, cols1 = img1.shape[:2]
         rows2, cols2 = img2.shape[:2]
@@ -95,11 +769,12 @@ class ImageStitcher:
 
         width = int(x_max - x_min)
         height = int(y_max - y_min)
-        max_output_size = 10000 * 10000 # modify for higher limit, jetson low
+        # limits come from the memory budget, see MemoryPlanner
+        max_output_size = self.compositor.max_output_size
 
-        if width > 20000 or height > 20000 or (width * height > max_output_size): # max before runtime error
+        if width > self.compositor.max_width or height > self.compositor.max_height or (width * height > max_output_size): # max before runtime error
             print(f"⚠️ Skipping warp: estimated output size too large ({width}x{height})")
-            return img1
+            return None
 
         translation_dist = [-x_min, -y_min]
         H_translation = np.array([[1, 0, translation_dist[0]],
@@ -121,7 +796,10 @@ class ImageStitcher:
         """Display the stitched result"""
         if self.result is not None:
             plt.figure(figsize=(15, 10))
-            plt.imshow(self.result)
+            if isinstance(self.result, TiledCanvas):
+                plt.imshow(cv2.cvtColor(self.result.overview(), cv2.COLOR_BGR2RGB))
+            else:
+                plt.imshow(self.result[..., ::-1])  # BGR to RGB as a view
             plt.axis('off')
             plt.show()
         else:
@@ -130,13 +808,35 @@ class ImageStitcher:
     # save result to desired folder, make folder if not defined
     def save_result(self, output_path):
         """Save the stitched result"""
-        if self.result is not None:
+        if isinstance(self.result, TiledCanvas):
+            with self.recorder.stage('encode', tiles=len(self.result.tiles)):
+                tile_dir = self.result.save(output_path)
+            print(f"Mosaic too large for a single image, tiles saved to {tile_dir}")
+        elif self.result is not None:
             Path(output_path).parent.mkdir(parents=True,exist_ok=True)
 
             # save result
-            cv2.imwrite(output_path, cv2.cvtColor(self.result, cv2.COLOR_RGB2BGR))
+            with self.recorder.stage('encode'):
+                cv2.imwrite(output_path, self.result)
             print(f"Result saved to {output_path}")
 
+    def close(self):
+        """Delete the disk-backed tiles of a TiledCanvas result, once it has been saved or exported"""
+        if isinstance(self.result, TiledCanvas):
+            self.result.close()
+        self.result = None
+
+    def export_tiles(self, output_dir, tile_size=256, image_format='png'):
+        """Write the stitched result as a {z}/{x}/{y} tile pyramid, see TileExporter"""
+        if self.result is None:
+            print("No result available. Run stitch_images first.")
+            return None
+        exporter = TileExporter(tile_size, image_format, workers=self.load_workers)
+        with self.recorder.stage('tiles') as info:
+            metadata = exporter.export(self.result, output_dir)
+            info['max_zoom'] = metadata['max_zoom']
+        return metadata
+
 # optional function, not part of class Stitch
 def file_transfer(destination_folder, result_file):
     try:
@@ -152,7 +852,13 @@ if __name__ == "__main__":
     stitcher = ImageStitcher(
         nfeatures=2000,        # Number of ORB features to detect
         min_matches=5,         # Minimum matches required
-        distance_threshold=0.7  # Distance threshold for matching
+        distance_threshold=0.7, # Distance threshold for matching
+        memory_budget=None,     # e.g. '3G' on the Jetson, None plans within the RAM available
+        mode='chained',         # Match cached frame features instead of the growing mosaic
+        workers=None,           # Processes for feature extraction and matching, defaults to all cores
+        registration_size=800,  # Match on small proxies...
+        max_size=None,          # ...and render the mosaic from full-resolution frames
+        recorder=StageRecorder(verbose=True)  # Print per-stage timing and memory as stages finish
     )
 
     # Process images
@@ -162,14 +868,20 @@ if __name__ == "__main__":
         # Specify your destination for result folder
         destination_folder = r'/home/astra/ODLC_Machine_Inferencing_System_2024-2025/odm_auto_code/results'
 
+        # Drop blurred and near-duplicate frames, they only make registration worse
+        frames, _ = FrameFilter().filter(stitcher.image_files(image_folder))
+
         # Stitch images
-        stitcher.stitch_images(image_folder)
+        stitcher.stitch_images(frames)
         
         # Save with timestamp and size indication
         from datetime import datetime
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         result_file = Path(destination_folder) / f"stitched_output_{timestamp}.jpg"
         stitcher.save_result(str(result_file))
+        # Tile pyramid for map viewers and tile-by-tile inference
+        stitcher.export_tiles(Path(destination_folder) / f"stitched_tiles_{timestamp}")
+        stitcher.recorder.to_jsonl(Path(destination_folder) / f"stitch_stages_{timestamp}.jsonl")
         
         #stitcher.show_result()
 
@@ -177,4 +889,6 @@ if __name__ == "__main__":
         # file_transfer(destination_folder, result_file)
 
     except Exception as e:
-        print(f"Error during stitching: {e}")
\ No newline at end of file
+        print(f"Error during stitching: {e}")
+    finally:
+        stitcher.close()  # a mosaic tiled to disk is deleted from the temp folder once saved
\ No newline at end of file
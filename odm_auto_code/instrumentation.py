@@ -0,0 +1,176 @@
+import json
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _read_hwm():
+    """Peak resident set size of this process in MB, None when it cannot be read"""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    try:
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except AttributeError:  # no psutil, or not on Windows
+        return None
+
+
+def _reset_hwm():
+    """Reset the kernel's peak RSS counter so it covers a single stage (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _cpu_time():
+    """CPU seconds used by this process and its children, e.g. pool workers
+
+    os.times() only counts children once they have been reaped, so live pool workers are
+    added through psutil when it is installed. Without it, work done by workers that are
+    still running when a stage ends is missing from that stage.
+    """
+    t = os.times()
+    total = t.user + t.system + t.children_user + t.children_system
+    if psutil is not None:
+        try:
+            children = psutil.Process().children(recursive=True)
+        except psutil.Error:
+            children = []
+        for child in children:
+            try:
+                times = child.cpu_times()
+                total += times.user + times.system
+            except psutil.Error:
+                pass  # exited between listing and reading, now counted as reaped
+    return total
+
+
+class StageRecorder:
+    """Record wall time, CPU time and peak RSS for named pipeline stages
+
+    Use as `with recorder.stage('match', pairs=12): ...`. Every finished stage is passed
+    to the registered callbacks and kept in `records` for export as JSON lines.
+
+    The peak RSS counter belongs to the whole process, so it is only reset for stages that
+    start while no stage is open in another thread. A stage that overlaps one in another
+    thread is recorded with 'peak_scope': 'process', its peak includes the other stage's.
+    """
+
+    def __init__(self, callbacks=None, output_path=None, verbose=False):
+        self.records = []
+        self.callbacks = list(callbacks or [])
+        self.output_path = output_path  # stages are appended here as they finish when set
+        self.verbose = verbose
+        self._local = threading.local()  # open stages per thread, stages may run concurrently
+        self._lock = threading.Lock()
+        self._open = []  # (thread id, frame) of the stages open in every thread
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name, **info):
+        # Nested stages reset the peak counter, so fold what the parent saw so far into it first
+        if self._stack:
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'] or 0, _read_hwm() or 0)
+        frame = {'peak': None, 'shared': False}
+        thread = threading.get_ident()
+        with self._lock:
+            others = [f for t, f in self._open if t != thread]
+            for other in others:
+                other['shared'] = True
+            if others:
+                frame['shared'] = True  # resetting would wipe the other stages' peaks
+            else:
+                _reset_hwm()
+            self._open.append((thread, frame))
+        self._stack.append(frame)
+
+        started = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_time()
+        status = 'ok'
+        try:
+            yield info
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self._stack.pop()
+            with self._lock:
+                self._open = [(t, f) for t, f in self._open if f is not frame]
+            peak = max(frame['peak'] or 0, _read_hwm() or 0) or None
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'] or 0, peak or 0)
+
+            record = {
+                'stage': name,
+                'started': round(started, 3),
+                'wall_s': round(time.perf_counter() - wall_start, 4),
+                'cpu_s': round(_cpu_time() - cpu_start, 4),
+                'peak_rss_mb': round(peak, 1) if peak else None,
+                'peak_scope': 'process' if frame['shared'] else 'stage',
+                'status': status,
+            }
+            record.update(info)
+            self._finish(record)
+
+    def _finish(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.verbose:
+                print(f"[{record['stage']}] {record['wall_s']:.2f}s wall, {record['cpu_s']:.2f}s cpu, "
+                      f"peak {record['peak_rss_mb']} MB")
+            if self.output_path:
+                self.to_jsonl(self.output_path, [record])
+        for callback in self.callbacks:
+            callback(record)
+
+    def summary(self):
+        """Totals per stage name: count, wall and CPU seconds, highest peak RSS"""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': None})
+            total['count'] += 1
+            total['wall_s'] = round(total['wall_s'] + record['wall_s'], 4)
+            total['cpu_s'] = round(total['cpu_s'] + record['cpu_s'], 4)
+            if record['peak_rss_mb'] is not None:
+                total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0, record['peak_rss_mb'])
+        return totals
+
+    def to_jsonl(self, output_path, records=None):
+        """Append records (all by default) to a JSON lines file"""
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'a') as f:
+            for record in self.records if records is None else records:
+                f.write(json.dumps(record) + '\n')
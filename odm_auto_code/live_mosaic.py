@@ -0,0 +1,226 @@
+import cv2
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from file_watcher import StableFileWatcher
+from gps_index import read_gps
+from image_stitch import ImageStitcher, _load_image
+from instrumentation import StageRecorder
+
+
+class SparseCanvas:
+    """Unbounded mosaic canvas made of in-memory tiles created on first write
+
+    Coordinates are those of the first frame, so the canvas can grow in any direction
+    as frames arrive without ever being reallocated or copied.
+    """
+
+    def __init__(self, tile_size=1024, channels=3, dtype=np.uint8):
+        self.tile_size = tile_size
+        self.channels = channels
+        self.dtype = dtype
+        self.tiles = {}
+
+    def tile(self, row, col):
+        if (row, col) not in self.tiles:
+            self.tiles[(row, col)] = np.zeros((self.tile_size, self.tile_size, self.channels), dtype=self.dtype)
+        return self.tiles[(row, col)]
+
+    def paste(self, compositor, img, H):
+        """Warp img by H into the tiles under its footprint, returns its bounds (x0, y0, x1, y1)"""
+        corners = compositor.frame_corners(img.shape, H)
+        x0, y0 = np.int32(np.floor(corners.min(axis=0)))
+        x1, y1 = np.int32(np.ceil(corners.max(axis=0)))
+        for row in range(y0 // self.tile_size, (y1 - 1) // self.tile_size + 1):
+            for col in range(x0 // self.tile_size, (x1 - 1) // self.tile_size + 1):
+                compositor.paste(self.tile(row, col), img, H, (col * self.tile_size, row * self.tile_size))
+        return int(x0), int(y0), int(x1), int(y1)
+
+    def bounds(self):
+        """Pixel bounds (x0, y0, x1, y1) covered by tiles, None while empty"""
+        if not self.tiles:
+            return None
+        rows = [r for r, _ in self.tiles]
+        cols = [c for _, c in self.tiles]
+        return (min(cols) * self.tile_size, min(rows) * self.tile_size,
+                (max(cols) + 1) * self.tile_size, (max(rows) + 1) * self.tile_size)
+
+    def read_region(self, x0, y0, x1, y1):
+        """Copy of a rectangle of the canvas, black where nothing has been drawn"""
+        region = np.zeros((y1 - y0, x1 - x0, self.channels), dtype=self.dtype)
+        for (row, col), tile in self.tiles.items():
+            tx0, ty0 = col * self.tile_size, row * self.tile_size
+            ix0, iy0 = max(x0, tx0), max(y0, ty0)
+            ix1, iy1 = min(x1, tx0 + self.tile_size), min(y1, ty0 + self.tile_size)
+            if ix1 > ix0 and iy1 > iy0:
+                region[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = tile[iy0 - ty0:iy1 - ty0, ix0 - tx0:ix1 - tx0]
+        return region
+
+
+class LiveMosaic:
+    """Grow a mosaic frame by frame while images are still arriving
+
+    Each new frame is matched only against the cached features of registered frames whose
+    GPS footprints overlap it (or the most recent frames without GPS) and drawn into the
+    tiles it covers, so the cost per frame does not grow with the size of the map. Frames
+    that match nothing yet are retried as later frames arrive. snapshot() can be called
+    from any thread at any time for the map so far.
+    """
+
+    def __init__(self, folder=None, max_size=1000, nfeatures=2000, distance_threshold=0.7, neighbours=4,
+                 max_pending=20, tile_size=1024, stable_seconds=2.0, workers=4, recorder=None):
+        self.folder = Path(folder) if folder else None
+        self.max_size = max_size  # frames are registered and drawn at this size, a preview of the final map
+        self.neighbours = neighbours  # recent frames tried for frames without GPS
+        self.max_pending = max_pending
+        self.stable_seconds = stable_seconds
+        self.stitcher = ImageStitcher(nfeatures=nfeatures, distance_threshold=distance_threshold, mode='chained',
+                                      workers=1, max_size=max_size)
+        self.compositor = self.stitcher.compositor
+        self.canvas = SparseCanvas(tile_size)
+        self.recorder = recorder or StageRecorder()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.callbacks = []  # called with (path, bounds) after every frame is drawn
+
+        self.paths = []
+        self.features = []
+        self.positions = []
+        self.transforms = []
+        self.pending = []  # (path, image, features, position) of frames not registered yet
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def candidates(self, position):
+        """Indices of registered frames worth matching against a frame at position"""
+        recent = list(range(len(self.paths) - 1, max(-1, len(self.paths) - 1 - self.neighbours), -1))
+        located = [i for i, p in enumerate(self.positions) if p is not None]
+        if position is None or not located:
+            return recent
+
+        index = self.stitcher.footprint_index
+        centres, radii = index.footprints([self.positions[i] for i in located] + [position])
+        distances = np.linalg.norm(centres[:-1] - centres[-1], axis=1)
+        reach = (radii[:-1] + radii[-1]) * index.overlap_margin
+        overlapping = [located[k] for k in np.argsort(distances) if distances[k] < reach[k]]
+        return overlapping[:index.max_candidates] or recent
+
+    def register(self, features, position):
+        """Transform into the mosaic for a new frame, None if it matches no registered frame"""
+        if not self.paths:
+            return np.eye(3)
+        candidates = self.candidates(position)
+        results = self.executor.map(lambda i: self.stitcher.match_features(self.features[i], features), candidates)
+        best = max(((inliers, i, H) for i, (H, inliers) in zip(candidates, results) if H is not None),
+                   default=None, key=lambda r: r[0])
+        if best is None:
+            return None
+        _, i, H = best
+        return self.transforms[i].dot(H)
+
+    def add_frame(self, path):
+        """Register and draw one frame, returns True once it is part of the mosaic"""
+        with self.recorder.stage('live_frame', frame=Path(path).name) as info:
+            img = _load_image(path, self.max_size)
+            if img is None:
+                print(f"Skipping unreadable frame {Path(path).name}")
+                return False
+            features = self.stitcher.detect_features(img)
+            position = read_gps(path)
+            info['drawn'] = self._place(path, img, features, position)
+
+        if info['drawn']:
+            # A newly drawn frame may be the link a waiting frame was missing
+            retry, self.pending = self.pending, []
+            for pending in retry:
+                if not self._place(*pending):
+                    self.pending.append(pending)
+        else:
+            self.pending.append((path, img, features, position))
+            if len(self.pending) > self.max_pending:
+                dropped = self.pending.pop(0)
+                print(f"Warning: {Path(dropped[0]).name} never matched the mosaic, dropped")
+        return info['drawn']
+
+    def _place(self, path, img, features, position):
+        T = self.register(features, position)
+        if T is None:
+            return False
+        with self._lock:
+            bounds = self.canvas.paste(self.compositor, img, T)
+            self.paths.append(path)
+            self.features.append(features)
+            self.positions.append(position)
+            self.transforms.append(T)
+        print(f"Added {Path(path).name} to the live mosaic ({len(self.paths)} frames)")
+        for callback in self.callbacks:
+            callback(path, bounds)
+        return True
+
+    def run(self, stop_event=None, idle_timeout=None):
+        """Add frames from the folder as they finish writing until stopped or idle"""
+        watcher = StableFileWatcher(self.folder, self.stable_seconds, poll_interval=0.5,
+                                    suffixes=('.jpg', '.jpeg', '.png'))
+        for path in watcher.watch(stop_event, idle_timeout):
+            self.add_frame(path)
+
+    def snapshot(self, max_size=None):
+        """(mosaic so far in BGR, (x, y) of its top left corner in first-frame pixels), None while empty"""
+        with self._lock:
+            bounds = self.canvas.bounds()
+            if bounds is None:
+                return None
+            image = self.canvas.read_region(*bounds)
+
+        # Crop the unused parts of the edge tiles
+        mask = image.any(axis=2)
+        rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            return None
+        image = image[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        origin = (bounds[0] + int(cols[0]), bounds[1] + int(rows[0]))
+        if max_size and max(image.shape[:2]) > max_size:
+            scale = max_size / max(image.shape[:2])
+            image = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)),
+                               interpolation=cv2.INTER_AREA)
+        return image, origin
+
+    def save_snapshot(self, output_path, max_size=None):
+        snapshot = self.snapshot(max_size)
+        if snapshot is None:
+            return None
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(output_path), snapshot[0])
+        return output_path
+
+    def close(self):
+        self.executor.shutdown()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build a mosaic from frames as they land in a folder")
+    parser.add_argument('folder')
+    parser.add_argument('--output', default='./results/live_mosaic.jpg')
+    parser.add_argument('--every', type=int, default=5, help="write a snapshot every N frames")
+    parser.add_argument('--idle-timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    mosaic = LiveMosaic(args.folder)
+
+    def write_snapshot(path, bounds):
+        if len(mosaic.paths) % args.every == 0:
+            mosaic.save_snapshot(args.output, max_size=4000)
+
+    mosaic.add_callback(write_snapshot)
+    try:
+        mosaic.run(idle_timeout=args.idle_timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mosaic.save_snapshot(args.output)
+        mosaic.close()
+        print(f"Live mosaic saved to {args.output}")
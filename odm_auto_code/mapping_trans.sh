@@ -1,8 +1,7 @@
 #!/bin/bash
 echo "Starting execution..."
 
-python main.py
-sleep 5
-python copy_transfer.py
+# ingest -> filter -> ODM -> download -> transfer, resumes from the last finished stage if rerun
+python mission.py "${1:-mission_config.json}"
 
-echo "All Python scripts have finished running"
\ No newline at end of file
+echo "All Python scripts have finished running"
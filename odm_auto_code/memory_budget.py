@@ -0,0 +1,139 @@
+import os
+import math
+import shutil
+import tempfile
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_UNITS = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+# Rough per-process cost of a pool worker with cv2 and numpy imported
+WORKER_OVERHEAD = 80 << 20
+# Bytes kept per ORB feature: a 32 byte descriptor plus a float32 (x, y) position
+FEATURE_BYTES = 40
+
+
+def available_memory():
+    """Bytes of RAM available to new allocations without swapping"""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 2 << 30  # unknown platform, assume a small board
+
+
+def parse_bytes(value):
+    """Bytes from an int or a size string like '6G' or '512MB'"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = value.strip().lower().rstrip('ib')
+    if text and text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(float(text))
+
+
+class MemoryPlanner:
+    """Choose stitching resolution, tiling and parallelism that fit a memory budget
+
+    The budget is given in bytes (or as '6G'), or taken as `fraction` of the RAM available
+    when the planner is created. Plans degrade in steps: fewer workers first, then tiling
+    the canvas, then a smaller decode window, and only then a lower resolution, so every
+    frame is still used on small boards.
+    """
+
+    def __init__(self, budget=None, fraction=0.6, min_registration_size=400, min_render_size=800,
+                 tile_sizes=(4096, 2048, 1024), tile_directory=None):
+        self.budget = parse_bytes(budget) or int(available_memory() * fraction)
+        self.min_registration_size = min_registration_size
+        self.min_render_size = min_render_size
+        self.tile_sizes = tile_sizes
+        self.tile_directory = tile_directory
+
+    @staticmethod
+    def frame_bytes(frame_size, long_side, channels=3):
+        """Bytes of a decoded frame of frame_size (w, h) scaled to long_side"""
+        scale = min(1.0, long_side / max(frame_size)) if long_side else 1.0
+        return int(frame_size[0] * scale) * int(frame_size[1] * scale) * channels
+
+    def registration_plan(self, num_frames, frame_size, nfeatures, registration_size, workers):
+        """(registration_size, workers) for feature extraction and matching
+
+        Each worker holds a decoded proxy frame plus its grayscale ORB pyramid, and the
+        parent keeps every frame's features for matching.
+        """
+        features = 2 * num_frames * nfeatures * FEATURE_BYTES  # results plus the copies sent to matchers
+        size = registration_size or max(frame_size)
+
+        def per_worker(size):
+            pixels = self.frame_bytes(frame_size, size) // 3
+            return WORKER_OVERHEAD + pixels * (3 + 1 + 3)  # BGR, gray, ~3x gray for the pyramid
+
+        while True:
+            room = self.budget - features
+            fitting = max(1, min(workers, room // per_worker(size))) if room > 0 else 1
+            if room >= fitting * per_worker(size) or size <= self.min_registration_size:
+                break
+            size = max(self.min_registration_size, int(size * 0.75))
+        if size != (registration_size or max(frame_size)) or fitting != workers:
+            print(f"Memory budget {self.budget >> 20} MB: registering at {size}px with {fitting} worker(s)")
+        return (size if registration_size or size != max(frame_size) else None), int(fitting)
+
+    def load_plan(self, num_frames, frame_size, max_size):
+        """Decode size that lets all frames sit in memory at once (the 'mosaic' mode)"""
+        size = max_size or max(frame_size)
+        # the growing mosaic and its warped copy need about as much again as the frames
+        while 3 * num_frames * self.frame_bytes(frame_size, size) > self.budget and size > self.min_render_size:
+            size = max(self.min_render_size, int(size * 0.75))
+        if size != (max_size or max(frame_size)):
+            print(f"Memory budget {self.budget >> 20} MB: loading {num_frames} frames at {size}px")
+        return size
+
+    def render_plan(self, width, height, frame_shape, load_workers, channels=3):
+        """How to composite a width x height canvas from frames of frame_shape
+
+        Returns a dict with 'scale' (applied to the canvas and every frame), 'tile_size',
+        'load_workers' and 'max_output_size', the largest canvas in pixels that MosaicCompositor
+        should keep in memory; larger canvases are tiled to disk.
+        """
+        frame_h, frame_w = frame_shape[:2]
+        free_disk = shutil.disk_usage(self.tile_directory or tempfile.gettempdir()).free
+
+        scale = 1.0
+        while True:
+            w, h = int(width * scale), int(height * scale)
+            fw, fh = int(frame_w * scale), int(frame_h * scale)
+            frame = 2 * fw * fh * channels  # two frames decoded ahead per loader thread
+            plan = {'scale': scale, 'tile_size': self.tile_sizes[-1], 'load_workers': 1,
+                    'max_output_size': max(1, (self.budget - frame) // channels)}
+
+            # 1. the whole canvas in memory
+            if w * h * channels + frame <= self.budget:
+                plan['load_workers'] = int(min(load_workers, (self.budget - w * h * channels) // frame))
+                plan['tile_size'] = self.tile_sizes[0]
+                return plan
+
+            # 2. disk-backed tiles, only the tiles under the current frame stay resident
+            if w * h * channels <= 0.9 * free_disk:
+                for tile_size in self.tile_sizes:
+                    touched = (math.ceil(fw / tile_size) + 1) * (math.ceil(fh / tile_size) + 1)
+                    tiles = touched * tile_size * tile_size * channels
+                    if tiles + frame <= self.budget:
+                        plan['load_workers'] = int(min(load_workers, (self.budget - tiles) // frame))
+                        plan['tile_size'] = tile_size
+                        return plan
+
+            # 3. lower the rendering resolution
+            if max(fw, fh) <= self.min_render_size:
+                return plan
+            scale *= 0.75
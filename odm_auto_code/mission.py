@@ -0,0 +1,358 @@
+import os
+import copy
+import json
+import queue
+import argparse
+import threading
+from pathlib import Path
+from copy_transfer import ResultsTransfer
+from file_watcher import StableFileWatcher
+from frame_filter import FrameFilter, frame_score
+from instrumentation import StageRecorder
+from telemetry import ResourceSampler
+from tile_export import TileExporter
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+STAGES = ('ingest', 'filter', 'process', 'download', 'transfer')
+ORTHOPHOTO = 'odm_orthophoto/odm_orthophoto.tif'
+
+DEFAULT_CONFIG = {
+    'image_folder': './images',
+    'results_folder': './results',
+    'destination_folder': None,  # no transfer stage when unset
+    'state_file': None,  # defaults to <results_folder>.state.json, next to and not inside the results
+    'stages_log': None,  # JSON lines of per-stage timing and memory
+    'backend': 'odm',  # 'odm' or 'stitch'
+    'queue_size': 64,  # bound on images waiting between ingest and filter
+    'concurrency': {'filter': 4, 'transfer': 8, 'upload': 10},
+    'ingest': {'watch': False, 'stable_seconds': 2.0, 'idle_timeout': 60.0},
+    'filter': {'blur_ratio': 0.35, 'min_sharpness': None, 'duplicate_distance': 4, 'window': 8},
+    'odm': {'host': 'localhost', 'port': 3000, 'container_name': 'nodeodm', 'reuse': True, 'options': {},
+            'cache_dir': None, 'upload_max_size': None, 'upload_gsd': None,
+            # height above ground for upload_gsd when images have no DJI relative altitude, in meters
+            'flight_height': None, 'ground_elevation': None},
+    'stitch': {'mode': 'chained', 'registration_size': 800, 'max_size': None, 'memory_budget': None,
+               'output_name': 'stitched_output.jpg'},
+    'transfer': {'stable_seconds': 5.0, 'retry_delay': 10},
+    # {z}/{x}/{y} tile pyramid of the mosaic or orthophoto under results_folder/<folder>, off when folder is unset
+    'tiles': {'folder': None, 'tile_size': 256, 'format': 'png', 'geo': False},
+    # resource samples as JSON lines plus a <name>.summary.json per-stage report, off when output is unset
+    'telemetry': {'output': None, 'interval': 1.0, 'slow_interval': 5.0},
+}
+
+_DONE = object()
+
+
+def _merge(defaults, overrides):
+    merged = copy.deepcopy(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict) and key != 'options':
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(config_path):
+    """Mission config from a JSON file, with missing keys taken from DEFAULT_CONFIG"""
+    with open(config_path) as f:
+        return _merge(DEFAULT_CONFIG, json.load(f))
+
+
+class MissionState:
+    """Progress of a mission, saved after every change so a crashed run can resume"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            with open(self.path) as f:
+                self.stages = json.load(f)
+        except (OSError, ValueError):
+            self.stages = {}
+
+    def done(self, stage):
+        return self.stages.get(stage, {}).get('done', False)
+
+    def get(self, stage, key, default=None):
+        return self.stages.get(stage, {}).get(key, default)
+
+    def update(self, stage, done=False, **outputs):
+        self.stages.setdefault(stage, {}).update(outputs, done=done)
+        self.save()
+
+    def reset(self):
+        self.stages = {}
+        self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.stages, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class MissionPipeline:
+    """ingest -> filter -> ODM or local stitch -> download -> transfer
+
+    Ingest and filter stream images through a bounded queue, and transfer runs alongside
+    download, copying each output as soon as it is complete. Each stage has its own
+    concurrency limit, and finished stages are recorded in the state file so a rerun
+    picks up after the last one that completed.
+    """
+
+    def __init__(self, config, recorder=None):
+        self.config = config
+        self.results_folder = Path(config['results_folder'])
+        # Kept outside the results folder so it is neither transferred nor cached with the results
+        results = self.results_folder.resolve()
+        default_state = results.with_name(results.name + '.state.json')
+        self.state = MissionState(config['state_file'] or default_state)
+        self.recorder = recorder or StageRecorder(output_path=config['stages_log'], verbose=True)
+
+    def run(self, restart=False):
+        if restart:
+            self.state.reset()
+        done = [stage for stage in STAGES if self.state.done(stage)]
+        if done:
+            print(f"Resuming mission, already finished: {', '.join(done)}")
+
+        settings = self.config['telemetry']
+        sampler = None
+        if settings['output']:
+            containers = [] if self.config['backend'] == 'stitch' else [self.config['odm']['container_name']]
+            sampler = ResourceSampler(settings['interval'], settings['output'], containers=containers,
+                                      slow_interval=settings['slow_interval'], recorder=self.recorder).start()
+        try:
+            images = self.ingest_and_filter()
+            if self.config['backend'] == 'stitch':
+                self.stitch(images)
+            else:
+                self.process_odm(images)
+        finally:
+            if sampler is not None:
+                sampler.stop()
+                sampler.report(Path(settings['output']).with_suffix('.summary.json'))
+        print("Mission complete")
+
+    # ingest / filter
+
+    def _ingest(self, out_queue, workers):
+        """Put image paths on the queue, either the folder as it is or frames as they land"""
+        folder = Path(self.config['image_folder'])
+        settings = self.config['ingest']
+        count = 0
+        try:
+            with self.recorder.stage('ingest', watch=settings['watch']) as info:
+                if settings['watch']:
+                    watcher = StableFileWatcher(folder, settings['stable_seconds'], suffixes=IMAGE_EXTENSIONS)
+                    paths = watcher.watch(idle_timeout=settings['idle_timeout'])
+                else:
+                    paths = sorted(p for p in folder.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+                for path in paths:
+                    out_queue.put(str(path))  # blocks while filter is behind
+                    count += 1
+                info['images'] = count
+        finally:
+            # the filter threads wait for these even when ingest fails, or the process would hang
+            for _ in range(workers):
+                out_queue.put(_DONE)
+        self.state.update('ingest', done=True, images=count)
+
+    def _filter_worker(self, in_queue, scores, lock):
+        # OpenCV releases the GIL while decoding, so threads score frames in parallel
+        while True:
+            path = in_queue.get()
+            if path is _DONE:
+                return
+            try:
+                score = frame_score(path)
+            except Exception as e:
+                # a dead worker would leave ingest blocked on the full queue
+                print(f"Skipping frame {Path(path).name}, it could not be scored: {e}")
+                continue
+            with lock:
+                scores[path] = score
+
+    def ingest_and_filter(self):
+        """Images that passed the filter, running both stages concurrently
+
+        Frames are scored for sharpness and hashed as they are ingested; blurred frames and
+        near-duplicates are dropped once the whole set is known.
+        """
+        if self.state.done('filter'):
+            return self.state.get('filter', 'images')
+
+        workers = self.config['concurrency']['filter']
+        image_queue = queue.Queue(maxsize=self.config['queue_size'])
+        scores, lock = {}, threading.Lock()
+        threads = [threading.Thread(target=self._filter_worker, args=(image_queue, scores, lock))
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        with self.recorder.stage('filter') as info:
+            try:
+                self._ingest(image_queue, workers)
+            finally:
+                for thread in threads:
+                    thread.join()
+            paths = sorted(scores)
+            settings = self.config['filter']
+            frame_filter = FrameFilter(settings['blur_ratio'], settings['min_sharpness'],
+                                       settings['duplicate_distance'], settings['window'])
+            images, dropped = frame_filter.select(paths, [scores[p] for p in paths])
+            info['images'] = len(images)
+            info['dropped'] = len(dropped)
+        for path, reason in sorted(dropped.items()):
+            print(f"Dropping {reason} frame {Path(path).name}")
+
+        if not images:
+            raise FileNotFoundError(f"No usable images found in {self.config['image_folder']}")
+        self.state.update('filter', done=True, images=images, dropped=dropped)
+        return images
+
+    # process / download / transfer
+
+    def _transfer_while(self, work):
+        """Run work() while transferring its outputs, then finish the transfer"""
+        destination = self.config['destination_folder']
+        if not destination:
+            work()
+            return
+        settings = self.config['transfer']
+        transfer = ResultsTransfer(self.results_folder, destination, retry_delay=settings['retry_delay'],
+                                   workers=self.config['concurrency']['transfer'])
+        stop_event = threading.Event()
+        transfer_thread = threading.Thread(target=transfer.watch, args=(stop_event,),
+                                           kwargs={'stable_seconds': settings['stable_seconds']})
+        transfer_thread.start()
+        try:
+            work()
+        finally:
+            stop_event.set()
+            with self.recorder.stage('transfer'):
+                transfer_thread.join()
+
+    def export_tiles(self, source):
+        """Tile pyramid of a mosaic array, TiledCanvas or orthophoto path, if enabled"""
+        settings = self.config['tiles']
+        if not settings['folder']:
+            return
+        if isinstance(source, Path) and not source.exists():
+            print(f"No {source.name} to tile")
+            return
+        exporter = TileExporter(settings['tile_size'], settings['format'])
+        output_dir = self.results_folder / settings['folder']
+        with self.recorder.stage('tiles'):
+            if settings['geo'] and isinstance(source, Path):
+                exporter.export_orthophoto(source, output_dir)
+            else:
+                exporter.export(source, output_dir)
+
+    def _resume_task(self, processor):
+        """Task submitted before a crash, if the node still has it, so images are not re-uploaded"""
+        from pyodm import exceptions
+
+        task_id = self.state.get('process', 'task')
+        if not task_id:
+            return None
+        try:
+            task = processor.node.get_task(task_id)
+            task.info()
+        except (exceptions.NodeResponseError, exceptions.NodeConnectionError):
+            print(f"Task {task_id} is gone from the node, submitting again")
+            self.state.update('process', task=None)
+            return None
+        print(f"Re-attached to task {task_id}")
+        return task
+
+    def process_odm(self, images):
+        from pyodm import exceptions
+        from odm_process import ODMProcessor
+        from result_cache import ResultCache
+        from upload_prep import UploadPreparer
+
+        settings = self.config['odm']
+        processor = ODMProcessor(
+            port=settings['port'], host=settings['host'], container_name=settings['container_name'],
+            reuse=settings['reuse'], recorder=self.recorder,
+            cache=ResultCache(settings['cache_dir']) if settings['cache_dir'] else None,
+            preparer=UploadPreparer(settings['upload_max_size'], settings['upload_gsd'],
+                                    flight_height=settings['flight_height'],
+                                    ground_elevation=settings['ground_elevation']),
+            parallel_uploads=self.config['concurrency']['upload'])
+        options = processor.default_options(settings['options'])
+
+        if self.state.done('download'):
+            if not self.state.done('transfer'):
+                self._transfer_while(lambda: None)
+                self.state.update('transfer', done=True)
+            return
+
+        hit, cache_key = processor.restore_cached(images, str(self.results_folder), options)
+        if hit:
+            self.state.update('process', done=True, cached=True)
+            self._transfer_while(lambda: self.export_tiles(self.results_folder / ORTHOPHOTO))
+            self.state.update('download', done=True)
+            self.state.update('transfer', done=True)
+            return
+
+        processor.start_container()
+        try:
+            task = self._resume_task(processor)
+            if task is None:
+                task = processor.submit(images, options)
+                self.state.update('process', task=task.uuid)
+            if not self.state.done('process'):
+                try:
+                    processor.wait(task)
+                except exceptions.TaskFailedError:
+                    print("\n".join(task.output()))
+                    self.state.update('process', task=None)
+                    raise
+                self.state.update('process', done=True, task=task.uuid)
+
+            def work():
+                processor.download(task, str(self.results_folder), cache_key, options)
+                self.export_tiles(self.results_folder / ORTHOPHOTO)
+
+            self._transfer_while(work)
+            self.state.update('download', done=True)
+            self.state.update('transfer', done=True)
+        finally:
+            processor.stop_container()
+
+    def stitch(self, images):
+        from image_stitch import ImageStitcher
+
+        if self.state.done('transfer'):
+            return
+        settings = self.config['stitch']
+        output_path = self.results_folder / settings['output_name']
+
+        def work():
+            if not self.state.done('download'):
+                stitcher = ImageStitcher(mode=settings['mode'], registration_size=settings['registration_size'],
+                                         max_size=settings['max_size'], memory_budget=settings['memory_budget'],
+                                         recorder=self.recorder)
+                try:
+                    stitcher.stitch_images(images)
+                    self.state.update('process', done=True)
+                    stitcher.save_result(str(output_path))
+                    self.export_tiles(stitcher.result)
+                finally:
+                    stitcher.close()
+                self.state.update('download', done=True, output=str(output_path))
+
+        self._transfer_while(work)
+        self.state.update('transfer', done=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a mapping mission from a config file")
+    parser.add_argument('config', help="mission config JSON, see mission_config.example.json")
+    parser.add_argument('--restart', action='store_true', help="ignore saved progress and start over")
+    args = parser.parse_args()
+
+    MissionPipeline(load_config(args.config)).run(restart=args.restart)
@@ -1,23 +1,99 @@
 import subprocess
 import os
 import sys
+import json
 import time
+import shutil
+import urllib.error
+import urllib.request
 from pyodm import Node, exceptions
+from instrumentation import StageRecorder
+from upload_prep import UploadPreparer
 
 class ODMProcessor:
-    def __init__(self, port=3000):
+    def __init__(self, port=3000, recorder=None, host='localhost', reuse=False, container_name='nodeodm',
+                 ready_timeout=180, cache=None, preparer=None, parallel_uploads=10):
         self.port = port
+        self.host = host
+        # attach to a healthy running container instead of recreating it, and leave it running afterwards
+        self.reuse = reuse
+        self.container_name = container_name
+        self.ready_timeout = ready_timeout
         self.container_id = None
         self.node = None
+        # per-stage wall time, CPU time and peak RSS, see instrumentation.StageRecorder
+        self.recorder = recorder or StageRecorder()
+        # optional result_cache.ResultCache, re-runs on the same images and options skip ODM
+        self.cache = cache
+        # optional upload_prep.UploadPreparer to downscale images before upload
+        self.preparer = preparer or UploadPreparer()
+        self.parallel_uploads = parallel_uploads
+
+    def _upload_progress(self):
+        """pyodm progress callback printing every 10% of the upload"""
+        last = [-10]
+
+        def callback(percent):
+            if percent >= last[0] + 10 or percent >= 100:
+                last[0] = percent
+                print(f"Upload {percent:.0f}%")
+        return callback
+
+    def node_info(self, timeout=2):
+        """NodeODM's /info response, None if the node does not answer"""
+        try:
+            with urllib.request.urlopen(f"http://{self.host}:{self.port}/info", timeout=timeout) as response:
+                return json.loads(response.read().decode())
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+
+    def wait_until_ready(self, timeout=None, initial_delay=0.25, max_delay=5.0):
+        """Poll the /info endpoint with exponential backoff until NodeODM answers"""
+        timeout = self.ready_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        while True:
+            info = self.node_info()
+            if info is not None:
+                return info
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"NodeODM at {self.host}:{self.port} not ready after {timeout} seconds")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+
+    def attach(self, timeout=None):
+        """Connect to an already running NodeODM without touching Docker"""
+        info = self.wait_until_ready(timeout)
+        print(f"NodeODM {info.get('version', '')} ready at {self.host}:{self.port}")
+        self.node = Node(self.host, self.port)
+
+    def running_container(self):
+        """ID of the running container with our name, None if there is none"""
+        result = subprocess.run(["docker", "ps", "-q", "--filter", f"name=^/{self.container_name}$",
+                                 "--filter", "status=running"], capture_output=True, text=True)
+        return result.stdout.strip() or None
 
     def start_container(self):
         """Start the Docker container for ODM processing"""
+        with self.recorder.stage('start'):
+            self._start_container()
+
+    def _start_container(self):
+        if self.reuse:
+            container_id = self.running_container()
+            if container_id and self.node_info() is not None:
+                self.container_id = container_id
+                print(f"Reusing running docker container {self.container_id}")
+                self.node = Node(self.host, self.port)
+                return
+
         # Stop and remove any existing container
-        subprocess.run(["docker", "rm", "-f", "nodeodm"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run(["docker", "rm", "-f", self.container_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
         # Start container
         process = subprocess.Popen(
-            ["docker", "run", "-d", "--name", "nodeodm", "-p", f"{self.port}:3000", "opendronemap/nodeodm"],
+            ["docker", "run", "-d", "--name", self.container_name, "-p", f"{self.port}:3000", "opendronemap/nodeodm"],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
@@ -30,16 +106,12 @@ class ODMProcessor:
         self.container_id = container_id.decode().strip()
         print(f"Docker container started with ID: {self.container_id}")
         
-        # Wait for container initialization
-        time.sleep(10)
-        self.node = Node("localhost", self.port)
+        # Wait until the node answers rather than a fixed delay
+        self.attach()
 
-    def process_images(self, image_folder, source_folder='./results', options=None):
-        """Process images using ODM"""
-        if not self.node:
-            raise RuntimeError("Container not started. Call start_container() first")
-
-        options = {
+    def default_options(self, options=None):
+        """ODM options with the caller's overriding the defaults"""
+        default_options = {
             'dsm': True,
             'orthophoto-resolution': 1,
             'pc-quality': 'low',
@@ -47,24 +119,94 @@ class ODMProcessor:
             'skip-3dmodel': True,
             'skip-report' : True
         }
-        
-        # if options:
-        #     default_options.update(options)
 
-        image_paths = [os.path.join(image_folder, f) 
-                      for f in os.listdir(image_folder) 
-                      if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        
+        if options:
+            default_options.update(options)
+        return default_options
+
+    def image_files(self, image_folder):
+        return [os.path.join(image_folder, f)
+                for f in os.listdir(image_folder)
+                if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+
+    def cache_key(self, image_paths, options):
+        """Result cache key for these images and effective options, None without a cache"""
+        if not self.cache or not image_paths:
+            return None
+        cache_options = dict(options, upload=self.preparer.settings()) if self.preparer.enabled else options
+        return self.cache.key(image_paths, cache_options)
+
+    def restore_cached(self, image_paths, source_folder, options):
+        """Restore cached results into source_folder, returns (hit, cache key)"""
+        if not self.cache or not image_paths:
+            return False, None
+        with self.recorder.stage('cache', images=len(image_paths)) as info:
+            cache_key = self.cache_key(image_paths, options)
+            info['hit'] = self.cache.restore(cache_key, source_folder)
+        if info['hit']:
+            print(f"Restored cached results for {len(image_paths)} images into {source_folder}")
+        return info['hit'], cache_key
+
+    def submit(self, image_paths, options):
+        """Prepare and upload images, returning the started pyodm task"""
+        if not self.node:
+            raise RuntimeError("Container not started. Call start_container() first")
+        if not image_paths:
+            raise FileNotFoundError("No image files to process")
+
+        if self.preparer.enabled:
+            with self.recorder.stage('prepare', images=len(image_paths)):
+                upload_paths = self.preparer.prepare(image_paths)
+        else:
+            upload_paths = image_paths
+
+        print(f"Uploading {len(upload_paths)} images...")
+        try:
+            with self.recorder.stage('upload', images=len(upload_paths)):
+                task = self.node.create_task(upload_paths, options, progress_callback=self._upload_progress(),
+                                             parallel_uploads=self.parallel_uploads)
+        finally:
+            self.preparer.cleanup()
+        print(task.info())
+        return task
+
+    def wait(self, task):
+        with self.recorder.stage('process', task=task.uuid):
+            task.wait_for_completion()
+
+    def download(self, task, source_folder, cache_key=None, options=None):
+        """Download task assets and add them to the result cache
+
+        With a cache the assets are downloaded into a folder of their own, copied to
+        source_folder and then moved into the cache, so only this task's files are cached.
+        """
+        if not cache_key:
+            with self.recorder.stage('download', task=task.uuid):
+                task.download_assets(source_folder)
+            return
+        download_dir = self.cache.download_dir(task.uuid)
+        with self.recorder.stage('download', task=task.uuid):
+            task.download_assets(str(download_dir))
+            shutil.copytree(download_dir, source_folder, dirs_exist_ok=True)
+        self.cache.store(cache_key, download_dir, options, move=True)
+
+    def process_images(self, image_folder, source_folder='./results', options=None):
+        """Process images using ODM, caller options override the defaults"""
+        options = self.default_options(options)
+        image_paths = self.image_files(image_folder)
+
+        hit, cache_key = self.restore_cached(image_paths, source_folder, options)
+        if hit:
+            return
+
         try:
             if not image_paths:
                 raise FileNotFoundError(f"No image files found in {image_folder}")
 
-            print(f"Uploading {len(image_paths)} images...")
-            task = self.node.create_task(image_paths, options)
-            print(task.info())
+            task = self.submit(image_paths, options)
             try:
-                task.wait_for_completion()
-                task.download_assets(source_folder)
+                self.wait(task)
+                self.download(task, source_folder, cache_key, options)
             except OSError as e:
                 if e.errno == 32:
                     print("Warning: File in use, WinError 32 case")
@@ -79,7 +221,11 @@ class ODMProcessor:
 
     def stop_container(self):
         """Stop the Docker container"""
-        if self.container_id:
+        if self.reuse and self.container_id:
+            print(f"Leaving docker container {self.container_id} running for the next mission")
+            self.container_id = None
+            self.node = None
+        elif self.container_id:
             print(f"Stopping docker container {self.container_id}...")
             subprocess.run(['docker', 'stop', self.container_id])
             self.container_id = None
@@ -90,6 +236,6 @@ class ODMProcessor:
         self.start_container()
         return self
 
-    def __exit__(self):
+    def __exit__(self, exc_type, exc_value, traceback):
         """Context manager exit"""
         self.stop_container()
\ No newline at end of file
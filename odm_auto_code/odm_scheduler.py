@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import queue
+import shutil
+import threading
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from pyodm import Node, exceptions
+from pyodm.types import TaskStatus
+from gps_index import FootprintIndex, read_gps
+from instrumentation import StageRecorder
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Per-submodel assets that are merged into mission-wide outputs
+MERGE_ASSETS = {
+    'orthophoto': 'odm_orthophoto/odm_orthophoto.tif',
+    'dsm': 'odm_dem/dsm.tif',
+}
+
+
+class SplitMergeScheduler:
+    """Split a dataset into overlapping submodels and run them on a pool of NodeODM nodes
+
+    Each node processes one submodel at a time. Tasks are uploaded and polled from worker
+    threads, so every node stays busy while progress is reported for all of them, and a
+    submodel that fails on one node is retried on another free node.
+    """
+
+    def __init__(self, nodes, submodel_size=40, overlap=8, split_by='sequence', options=None,
+                 poll_interval=5, max_attempts=2, info_retries=4, recorder=None):
+        self.nodes = [Node(host, port) for host, port in nodes]
+        self.submodel_size = submodel_size
+        self.overlap = overlap  # images shared with the neighbouring submodel, for 'sequence'
+        self.split_by = split_by  # 'sequence' (filename order) or 'gps' (geographic blocks)
+        self.options = options or {}
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.info_retries = info_retries  # status polls that may drop before a task is given up
+        self.recorder = recorder or StageRecorder()
+        self.progress = {}
+        self._lock = threading.Lock()
+
+    def split(self, image_paths):
+        """Overlapping groups of image paths, one per submodel"""
+        image_paths = sorted(image_paths)
+        if len(image_paths) <= self.submodel_size:
+            return [image_paths]
+        if self.split_by == 'gps':
+            positions = [read_gps(p) for p in image_paths]
+            if all(p is not None for p in positions):
+                return self._split_gps(image_paths, positions)
+            print("Not every image has GPS tags, splitting by sequence instead")
+        return self._split_sequence(image_paths)
+
+    def _split_sequence(self, image_paths):
+        step = max(1, self.submodel_size - self.overlap)
+        groups = []
+        for start in range(0, len(image_paths), step):
+            groups.append(image_paths[start:start + self.submodel_size])
+            if start + self.submodel_size >= len(image_paths):
+                break
+        return groups
+
+    def _split_gps(self, image_paths, positions):
+        centres, radii = FootprintIndex().footprints(positions)
+
+        # Recursive median bisection along the longer axis gives compact, similar-sized blocks
+        blocks = []
+        pending = [np.arange(len(image_paths))]
+        while pending:
+            indices = pending.pop()
+            if len(indices) <= max(1, self.submodel_size - self.overlap):
+                blocks.append(indices)
+                continue
+            axis = int(np.argmax(np.ptp(centres[indices], axis=0)))
+            ordered = indices[np.argsort(centres[indices, axis], kind='stable')]
+            half = len(ordered) // 2
+            pending.extend([ordered[:half], ordered[half:]])
+
+        # Grow every block by one footprint radius so neighbouring submodels overlap on the ground
+        margin = float(np.mean(radii))
+        groups = []
+        for block in sorted(blocks, key=lambda b: b.min()):
+            low = centres[block].min(axis=0) - margin
+            high = centres[block].max(axis=0) + margin
+            inside = np.all((centres >= low) & (centres <= high), axis=1)
+            groups.append([image_paths[i] for i in np.flatnonzero(inside)])
+        return groups
+
+    def _report(self, name, text):
+        with self._lock:
+            self.progress[name] = text
+            print(" | ".join(f"{k}: {v}" for k, v in sorted(self.progress.items())))
+
+    def _task_info(self, task, initial_delay=1.0, max_delay=30.0):
+        """task.info(), retried with exponential backoff while the node does not answer"""
+        delay = initial_delay
+        for attempt in range(self.info_retries + 1):
+            try:
+                return task.info()
+            except exceptions.NodeConnectionError:
+                if attempt == self.info_retries:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    def _discard(self, task):
+        """Cancel and remove a task that will be resubmitted, so it stops using the node"""
+        try:
+            task.cancel()
+            task.remove()
+        except (exceptions.NodeConnectionError, exceptions.NodeResponseError, OSError):
+            pass  # the node is down or already dropped the task
+
+    def _run_on_node(self, node, name, images, output_dir):
+        """Upload, wait for and download one submodel on one node"""
+        with self.recorder.stage('upload', submodel=name, node=node.host, images=len(images)):
+            task = node.create_task(images, self.options, name=name)
+        try:
+            with self.recorder.stage('process', submodel=name, node=node.host):
+                while True:
+                    info = self._task_info(task)
+                    if info.status == TaskStatus.COMPLETED:
+                        break
+                    if info.status in (TaskStatus.FAILED, TaskStatus.CANCELED):
+                        raise exceptions.TaskFailedError(f"{name} {info.status.name.lower()} on {node.host}")
+                    self._report(name, f"{info.progress:.0f}% on {node.host}:{node.port}")
+                    time.sleep(self.poll_interval)
+            with self.recorder.stage('download', submodel=name, node=node.host):
+                task.download_assets(str(output_dir))
+        except BaseException:
+            self._discard(task)
+            raise
+        self._report(name, "done")
+        return output_dir
+
+    def _acquire(self, free_nodes, avoid):
+        """Next free node, passing over the ones in avoid while any other node is left"""
+        while True:
+            node = free_nodes.get()
+            if node not in avoid or len(avoid) >= len(self.nodes):
+                return node
+            free_nodes.put(node)  # leave it to the other submodels
+            time.sleep(self.poll_interval)
+
+    def _run_submodel(self, free_nodes, name, images, output_dir):
+        """Run a submodel on whichever node frees up first, retrying on another node on failure"""
+        failed_nodes = set()
+        for attempt in range(self.max_attempts):
+            node = self._acquire(free_nodes, failed_nodes)
+            try:
+                return self._run_on_node(node, name, images, output_dir)
+            except (exceptions.NodeConnectionError, exceptions.NodeResponseError,
+                    exceptions.TaskFailedError, OSError) as e:
+                self._report(name, f"failed on {node.host}:{node.port} ({e})")
+                failed_nodes.add(node)
+                if attempt == self.max_attempts - 1:
+                    raise
+            finally:
+                free_nodes.put(node)
+
+    def run(self, image_paths, output_folder):
+        """Process all submodels concurrently, then merge their outputs
+
+        Returns the list of submodel result folders.
+        """
+        output_folder = Path(output_folder)
+        groups = self.split(image_paths)
+        print(f"Split {len(image_paths)} images into {len(groups)} submodels over {len(self.nodes)} nodes")
+
+        free_nodes = queue.Queue()
+        for node in self.nodes:
+            free_nodes.put(node)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(self.nodes)) as executor:
+            futures = {}
+            for k, images in enumerate(groups):
+                name = f"submodel_{k:03d}"
+                futures[executor.submit(self._run_submodel, free_nodes, name, images,
+                                        output_folder / name)] = name
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"Submodel {name} failed: {e}")
+
+        submodel_dirs = [results[name] for name in sorted(results)]
+        missing = sorted(set(futures.values()) - set(results))
+        with self.recorder.stage('merge', submodels=len(submodel_dirs)):
+            self.merge(submodel_dirs, output_folder, missing)
+        return submodel_dirs
+
+    def merge(self, submodel_dirs, output_folder, missing=None):
+        """Mosaic the submodel orthophotos and DSMs
+
+        With GDAL on the PATH each asset is combined into a virtual mosaic (VRT), which is
+        cheap to build and opens like a single GeoTIFF. The parts are always listed in
+        merge_manifest.json so they can be merged elsewhere, along with the names of
+        submodels that failed and are missing from the merge.
+        """
+        output_folder = Path(output_folder)
+        output_folder.mkdir(parents=True, exist_ok=True)
+        missing = list(missing or [])
+        if missing:
+            print(f"Warning: merging without {len(missing)} failed submodel(s): {', '.join(missing)}, "
+                  f"the merged outputs have gaps")
+        manifest = {'missing': missing}
+        for asset, rel_path in MERGE_ASSETS.items():
+            parts = [str(d / rel_path) for d in submodel_dirs if (d / rel_path).exists()]
+            manifest[asset] = {'parts': parts}
+            if parts and shutil.which('gdalbuildvrt'):
+                vrt_path = output_folder / f"merged_{asset}.vrt"
+                subprocess.run(['gdalbuildvrt', str(vrt_path)] + parts, check=True,
+                               stdout=subprocess.DEVNULL)
+                manifest[asset]['merged'] = str(vrt_path)
+                print(f"Merged {len(parts)} {asset} parts into {vrt_path}")
+
+        with open(output_folder / 'merge_manifest.json', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        return manifest
+
+
+if __name__ == '__main__':
+    image_folder = r'./datasets/Phalaborwa_lg'
+    image_paths = [os.path.join(image_folder, f) for f in os.listdir(image_folder)
+                   if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+    scheduler = SplitMergeScheduler(
+        nodes=[('localhost', 3000), ('localhost', 3001)],  # one entry per NodeODM instance
+        submodel_size=40,
+        overlap=8,
+        split_by='gps',
+        options={'dsm': True, 'orthophoto-resolution': 2, 'pc-quality': 'low', 'fast-orthophoto': True,
+                 'skip-3dmodel': True, 'skip-report': True},
+    )
+    scheduler.run(image_paths, './results')
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+
+
+class ResultCache:
+    """Content-addressed cache of ODM results
+
+    Entries are keyed by the content hashes of the input images plus the effective ODM
+    options, so renaming or re-copying a dataset still hits while any change to the
+    pixels or the options misses. The cache is kept under max_bytes by evicting the
+    least recently used entries.
+    """
+
+    def __init__(self, cache_dir='./odm_cache', max_bytes=50 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # image hashes remembered by path, size and mtime so re-runs do not re-read every image
+        self.hash_index_path = self.cache_dir / 'image_hashes.json'
+        self._lock = threading.Lock()
+
+    def _load_hash_index(self):
+        try:
+            with open(self.hash_index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def image_hashes(self, image_paths):
+        """sha256 of each image, reusing earlier hashes of files that have not changed"""
+        index = self._load_hash_index()
+        hashes = []
+        for path in image_paths:
+            stat = os.stat(path)
+            entry_key = os.path.abspath(path)
+            entry = index.get(entry_key)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                hashes.append(entry['sha256'])
+                continue
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            index[entry_key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+            hashes.append(digest.hexdigest())
+
+        with self._lock:
+            tmp_path = self.hash_index_path.with_name(self.hash_index_path.name + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.hash_index_path)
+        return hashes
+
+    def key(self, image_paths, options):
+        """Cache key for an image set and options dict, independent of file names and order"""
+        digest = hashlib.sha256()
+        for image_hash in sorted(self.image_hashes(image_paths)):
+            digest.update(image_hash.encode())
+        digest.update(json.dumps(options or {}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return self.cache_dir / 'entries' / key
+
+    def lookup(self, key):
+        """Path of the cached assets for key, None on a miss"""
+        assets = self.entry_path(key) / 'assets'
+        if not assets.is_dir():
+            return None
+        os.utime(self.entry_path(key) / 'meta.json')  # mark as recently used
+        return assets
+
+    def restore(self, key, destination):
+        """Copy cached assets for key into destination, returns False on a miss"""
+        assets = self.lookup(key)
+        if assets is None:
+            return False
+        shutil.copytree(assets, destination, dirs_exist_ok=True)
+        return True
+
+    def download_dir(self, name):
+        """Empty folder inside the cache for downloading one task's assets before they are stored
+
+        Downloading here rather than into the results folder keeps mission state, tiles and
+        leftovers of earlier runs out of the entry, and lets store() move the files in.
+        """
+        folder = self.cache_dir / 'downloads' / name
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True)
+        return folder
+
+    def store(self, key, source_folder, options=None, move=False):
+        """Add the assets in source_folder to the cache under key
+
+        With move the folder is moved into the cache instead of copied, and is gone afterwards.
+        """
+        entry = self.entry_path(key)
+        if entry.exists():
+            if move:
+                shutil.rmtree(source_folder, ignore_errors=True)
+            return entry
+        staging = entry.with_name(f"{key}.tmp{os.getpid()}")
+        shutil.rmtree(staging, ignore_errors=True)
+        if move:
+            staging.mkdir(parents=True)
+            shutil.move(str(source_folder), str(staging / 'assets'))
+        else:
+            shutil.copytree(source_folder, staging / 'assets')
+        size = sum(f.stat().st_size for f in (staging / 'assets').rglob('*') if f.is_file())
+        with open(staging / 'meta.json', 'w') as f:
+            json.dump({'created': time.time(), 'size': size, 'options': options}, f, indent=1)
+
+        # Rename into place so a crash never leaves a partial entry that looks valid
+        try:
+            os.replace(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)  # another run stored the same key first
+        self.evict()
+        return entry
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for meta_path in (self.cache_dir / 'entries').glob('*/meta.json'):
+            try:
+                with open(meta_path) as f:
+                    size = json.load(f)['size']
+                entries.append((meta_path.stat().st_mtime, size, meta_path.parent))
+            except (OSError, ValueError, KeyError):
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            print(f"Evicting cached result {path.name[:12]} ({size / (1 << 20):.0f} MB)")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -1,9 +1,33 @@
 import subprocess
+import threading
 import time
 from odm_process import ODMProcessor
 from copy_transfer import ResultsTransfer
+from instrumentation import StageRecorder
+from result_cache import ResultCache
+from telemetry import ResourceSampler
 
-processor = ODMProcessor()
+# Per-stage timing and memory are appended as JSON lines while the mission runs
+# Re-runs on the same images and options restore the cached results instead of running ODM again
+recorder = StageRecorder(output_path='./odm_stages.jsonl', verbose=True)
+processor = ODMProcessor(recorder=recorder, cache=ResultCache('./odm_cache'))
+
+# Host, process, disk and container usage sampled alongside the stages for hardware sizing
+sampler = ResourceSampler(interval=1.0, output_path='./odm_telemetry.jsonl', containers=[processor.container_name],
+                          recorder=recorder)
+
+custom_transfer = ResultsTransfer(
+    source_folder=r'C:\Users\valde\Desktop\cs_classes\SUAS\ODLC_Machine_Inferencing_System_2024-2025\odm_auto_code\results',
+    destination_folder=r'C:\Users\valde\Desktop\cs_classes\SUAS\ODLC_Machine_Inferencing_System_2024-2025\test',
+    retry_delay=10
+)
+
+# Ship outputs while ODM is still downloading them instead of waiting for the whole job
+stop_transfer = threading.Event()
+transfer_thread = threading.Thread(target=custom_transfer.watch, args=(stop_transfer,))
+transfer_thread.start()
+
+sampler.start()
 try:
     processor.start_container()
     processor.process_images(
@@ -12,11 +36,7 @@ try:
     )
 finally:
     processor.stop_container()
-
-custom_transfer = ResultsTransfer(
-    source_folder=r'C:\Users\valde\Desktop\cs_classes\SUAS\ODLC_Machine_Inferencing_System_2024-2025\odm_auto_code\results',
-    destination_folder=r'C:\Users\valde\Desktop\cs_classes\SUAS\ODLC_Machine_Inferencing_System_2024-2025\test',
-    retry_delay=10
-)
-
-custom_transfer.transfer_files()
\ No newline at end of file
+    stop_transfer.set()
+    transfer_thread.join()
+    sampler.stop()
+    sampler.report('./odm_telemetry.summary.json')
@@ -0,0 +1,201 @@
+import argparse
+import json
+import shutil
+import tempfile
+import time
+import cv2
+import numpy as np
+from pathlib import Path
+from image_stitch import ImageStitcher
+
+
+def make_texture(width, height, seed=0):
+    """Synthetic ground texture with detail at several scales so ORB finds features everywhere"""
+    rng = np.random.default_rng(seed)
+    texture = np.zeros((height, width, 3), np.float32)
+    for cell in (4, 16, 64, 256):
+        noise = rng.random((height // cell + 1, width // cell + 1, 3), dtype=np.float32)
+        # Coarse octaves are weighted down so the fine ones are not flattened by normalisation
+        texture += cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)[:height, :width] / np.sqrt(cell)
+    texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+    # Fields, roads and buildings give strong corners like real aerial imagery
+    for _ in range(width * height // 20000):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            w, h = rng.integers(10, 120, 2)
+            cv2.rectangle(texture, (x, y), (int(x + w), int(y + h)), color, -1)
+        else:
+            cv2.circle(texture, (x, y), int(rng.integers(5, 60)), color, -1)
+    return texture
+
+
+def make_dataset(folder, num_frames, frame_size, overlap=0.6, noise=4.0, blur=1.0, seed=0):
+    """Cut a texture into overlapping frames along serpentine flight lines
+
+    Returns the ground-truth homography of each frame into texture coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    frame_w, frame_h = frame_size, int(frame_size * 3 / 4)
+    step_x, step_y = frame_w * (1 - overlap), frame_h * (1 - overlap)
+    per_line = max(2, int(np.ceil(np.sqrt(num_frames))))
+    lines = int(np.ceil(num_frames / per_line))
+    margin = frame_size
+    texture = make_texture(int(step_x * per_line + frame_w + 2 * margin),
+                           int(step_y * lines + frame_h + 2 * margin), seed)
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    centre = np.array([[1, 0, -frame_w / 2], [0, 1, -frame_h / 2], [0, 0, 1]])
+    truths = []
+    for idx in range(num_frames):
+        line, pos = divmod(idx, per_line)
+        if line % 2:
+            pos = per_line - 1 - pos
+        angle = rng.normal(0, 2.0) * np.pi / 180
+        scale = 1 + rng.normal(0, 0.02)
+        tx = margin + frame_w / 2 + pos * step_x + rng.normal(0, step_x * 0.05)
+        ty = margin + frame_h / 2 + line * step_y + rng.normal(0, step_y * 0.05)
+        cos, sin = scale * np.cos(angle), scale * np.sin(angle)
+        H = np.array([[cos, -sin, tx], [sin, cos, ty], [0, 0, 1]]).dot(centre)
+
+        frame = cv2.warpPerspective(texture, np.linalg.inv(H), (frame_w, frame_h), flags=cv2.INTER_LINEAR)
+        if blur > 0:
+            frame = cv2.GaussianBlur(frame, (0, 0), blur)
+        if noise > 0:
+            frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+        cv2.imwrite(str(folder / f"frame_{idx:04d}.jpg"), frame, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        truths.append(H)
+    return truths
+
+
+def registration_error(stitcher, truths, shapes):
+    """Mean and max corner error in pixels of the estimated transforms against ground truth"""
+    reference = stitcher.reference
+    errors = []
+    for T, H, shape in zip(stitcher.transforms, truths, shapes):
+        if T is None:
+            continue
+        expected = np.linalg.inv(truths[reference]).dot(H)
+        corners = stitcher.compositor.frame_corners(shape, expected)
+        estimated = stitcher.compositor.frame_corners(shape, T)
+        errors.append(np.linalg.norm(corners - estimated, axis=1).mean())
+    if not errors:
+        return None, None
+    return float(np.mean(errors)), float(np.max(errors))
+
+
+def timed(stages, name, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    stages[name] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def run_case(num_frames, frame_size, workers, matcher, mode='chained', seed=0, max_error=10.0, gps=False):
+    """Time every stitching stage on one synthetic dataset
+
+    The record is marked 'failed' when frames were left out or the mean registration
+    error exceeds max_error pixels, its timings are then not comparable.
+    The synthetic frames carry no GPS tags, so with gps the pairs GPS footprints would give
+    are taken from the ground truth instead: every pair of frames whose centres lie within
+    1.3 frame widths.
+    """
+    folder = Path(tempfile.mkdtemp(prefix='stitch_bench_'))
+    try:
+        truths = make_dataset(folder / 'images', num_frames, frame_size, seed=seed)
+        stitcher = ImageStitcher(mode=mode, workers=workers, matcher=matcher, use_gps=False,
+                                 max_size=None)
+        stages = {}
+
+        img_list = timed(stages, 'load_images', stitcher.load_images, folder / 'images')
+        paths = stitcher.image_files(folder / 'images')
+        with stitcher.feature_pool() as executor:
+            stitcher.image_paths, stitcher.features, shapes, _ = timed(
+                stages, 'extract_features', stitcher.extract_features, paths, executor)
+            if gps:
+                centres = [H[:2, 2] for H in truths]
+                pairs = [(i, j) for i in range(num_frames) for j in range(i + 1, num_frames)
+                         if np.linalg.norm(centres[i] - centres[j]) < 1.3 * frame_size]
+            else:
+                pairs = stitcher.candidate_pairs()
+            pair_homographies = timed(stages, 'match', stitcher.match_pairs, pairs, executor)
+            pair_homographies = stitcher.overlapping_pairs(pair_homographies, shapes)
+            if mode == 'hierarchical':
+                stitcher.transforms = timed(stages, 'chain', stitcher.tree_homographies, len(shapes),
+                                            pair_homographies, shapes, executor=executor)
+            else:
+                stitcher.transforms = timed(stages, 'chain', stitcher.chain_homographies, len(shapes),
+                                            pair_homographies)
+                stitcher.transforms = timed(stages, 'refine', stitcher.refine_transforms, stitcher.transforms,
+                                            pair_homographies, shapes, stitcher.reference)
+
+        # Pairwise warp of the legacy mosaic mode, for comparison with single-pass compositing
+        if (0, 1) in pair_homographies:
+            timed(stages, 'warp_images', stitcher.warp_images, img_list[0], img_list[1], pair_homographies[(0, 1)][0])
+
+        connected = [i for i, T in enumerate(stitcher.transforms) if T is not None]
+        mosaic = timed(stages, 'composite', stitcher.compositor.composite, (img_list[i] for i in connected),
+                       [shapes[i] for i in connected], [stitcher.transforms[i] for i in connected])
+        stitcher.result = mosaic
+        timed(stages, 'save_result', stitcher.save_result, str(folder / 'result.jpg'))
+        stitcher.close()
+
+        mean_error, worst_error = registration_error(stitcher, truths, shapes)
+        failed = []
+        if len(connected) < num_frames:
+            failed.append(f"{num_frames - len(connected)} frame(s) not registered")
+        if mean_error is None or mean_error > max_error:
+            failed.append(f"mean error above {max_error} px")
+        return {
+            'frames': num_frames,
+            'frame_size': frame_size,
+            'workers': stitcher.workers,
+            'matcher': matcher,
+            'mode': mode,
+            'gps': gps,
+            'registered': len(connected),
+            'stages': stages,
+            'total': round(sum(stages.values()), 4),
+            'mean_error_px': mean_error,
+            'max_error_px': worst_error,
+            'failed': failed,
+        }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stitcher on synthetic aerial datasets")
+    parser.add_argument('--frames', type=int, nargs='+', default=[9, 25])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[800, 1600], help="frame widths in pixels")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--matcher', default='bf', choices=['bf', 'flann', 'crosscheck'])
+    parser.add_argument('--mode', default='chained', choices=['chained', 'hierarchical'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gps', action='store_true', help="pair frames as overlapping GPS footprints would")
+    parser.add_argument('--max-error', type=float, default=10.0,
+                        help="mean registration error in pixels above which a case counts as failed")
+    parser.add_argument('--output', help="also append results as JSON lines to this file")
+    args = parser.parse_args()
+
+    failures = 0
+    for frame_size in args.sizes:
+        for num_frames in args.frames:
+            record = run_case(num_frames, frame_size, args.workers, args.matcher, args.mode, args.seed,
+                              args.max_error, args.gps)
+            line = json.dumps(record)
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(line + '\n')
+            print(line)
+            if record['failed']:
+                failures += 1
+                print(f"FAILED {num_frames} frames at {frame_size}px: {'; '.join(record['failed'])}")
+    if failures:
+        raise SystemExit(f"{failures} case(s) failed registration, their timings are not valid results")
+
+
+if __name__ == '__main__':
+    main()
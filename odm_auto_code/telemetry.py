@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:  # /proc is read directly instead, Linux only
+    psutil = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _read_proc_stat():
+    """(busy, total) CPU jiffies over all cores"""
+    with open('/proc/stat') as f:
+        values = [int(v) for v in f.readline().split()[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values) - idle, sum(values)
+
+
+def _read_meminfo():
+    """(used, available) host memory in MB"""
+    info = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            info[key] = int(value.split()[0])
+    available = info.get('MemAvailable', info.get('MemFree', 0))
+    return (info['MemTotal'] - available) / 1024, available / 1024
+
+
+def _read_diskstats():
+    """(read, written) bytes over all whole disks since boot"""
+    read = written = 0
+    with open('/proc/diskstats') as f:
+        for line in f:
+            fields = line.split()
+            name = fields[2]
+            # skip partitions and virtual devices so nothing is counted twice
+            if name.startswith(('loop', 'ram', 'dm-')) or not os.path.exists(f'/sys/block/{name}'):
+                continue
+            read += int(fields[5]) * 512
+            written += int(fields[9]) * 512
+    return read, written
+
+
+def _proc_rss(pid):
+    """Resident memory of one process in MB, None if it has gone"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1 << 20)
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _proc_children(pid):
+    """Child process ids of pid, recursively"""
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        return children
+    return children + [grandchild for child in children for grandchild in _proc_children(child)]
+
+
+def _parse_size(text):
+    """MB from a docker size like '1.5GiB' or '300MB'"""
+    units = {'b': 1 / (1 << 20), 'kib': 1 / 1024, 'kb': 1 / 1000, 'mib': 1, 'mb': 1,
+             'gib': 1024, 'gb': 1000, 'tib': 1 << 20, 'tb': 1e6}
+    text = text.strip().lower()
+    number = text.rstrip('abcdefghijklmnopqrstuvwxyz')
+    try:
+        return round(float(number) * units.get(text[len(number):], 1), 1)
+    except ValueError:
+        return None
+
+
+class ResourceSampler:
+    """Sample host and process resources in a background thread while a job runs
+
+    Every `interval` seconds one sample is taken of host CPU and memory, this process's
+    RSS and that of each child (ODM workers, pool processes), and host disk throughput.
+    Docker container stats and GPU utilisation come from the docker and nvidia-smi CLIs,
+    which are slow to call, so they are sampled every `slow_interval` seconds in a second
+    thread. Samples are appended to output_path as JSON lines. Attach to a StageRecorder
+    and report() gives per-stage averages and peaks next to the stage timings.
+    """
+
+    def __init__(self, interval=1.0, output_path=None, containers=None, slow_interval=5.0, gpu=True,
+                 command_timeout=10.0, recorder=None):
+        self.interval = interval
+        self.output_path = Path(output_path) if output_path else None
+        self.containers = list(containers or [])  # docker container names or ids to sample
+        self.slow_interval = slow_interval
+        self.command_timeout = command_timeout  # seconds before a hung docker or nvidia-smi call is given up
+        self.gpu = gpu and shutil.which('nvidia-smi') is not None
+        self.samples = []
+        self.stages = []
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._last_cpu = None
+        self._last_disk = None
+        if recorder is not None:
+            self.attach(recorder)
+
+    def attach(self, recorder):
+        """Collect finished stages from a StageRecorder to line samples up with them"""
+        recorder.add_callback(self.stages.append)
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._loop, args=(self.interval, self.sample), daemon=True)]
+        if self.containers or self.gpu:
+            self._threads.append(threading.Thread(target=self._loop, args=(self.slow_interval, self.sample_slow),
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _loop(self, interval, sample):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self._add(sample())
+            except OSError as e:
+                # e.g. no /proc on Windows without psutil, or no docker CLI, it will not start working
+                print(f"Warning: telemetry {sample.__name__} failed ({e}), no further samples of this kind")
+                return
+            self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def _add(self, sample):
+        with self._lock:
+            self.samples.append(sample)
+            if self.output_path:
+                self.output_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.output_path, 'a') as f:
+                    f.write(json.dumps(sample, separators=(',', ':')) + '\n')
+
+    def sample(self):
+        """One sample of host CPU and memory, process memory and disk throughput"""
+        now = time.time()
+        sample = {'t': round(now, 2), 'kind': 'host'}
+        if psutil is not None:
+            process = psutil.Process()
+            children = process.children(recursive=True)
+            sample['cpu_pct'] = psutil.cpu_percent(interval=None)
+            memory = psutil.virtual_memory()
+            sample['mem_used_mb'] = round((memory.total - memory.available) / (1 << 20), 1)
+            sample['mem_avail_mb'] = round(memory.available / (1 << 20), 1)
+            rss = {}
+            for proc in [process] + children:
+                try:
+                    rss[proc.pid] = proc.memory_info().rss / (1 << 20)
+                except psutil.Error:
+                    continue
+            disk = psutil.disk_io_counters()
+            disk = (disk.read_bytes, disk.write_bytes) if disk else None
+        else:
+            busy, total = _read_proc_stat()
+            if self._last_cpu and total > self._last_cpu[1]:
+                sample['cpu_pct'] = round(100.0 * (busy - self._last_cpu[0]) / (total - self._last_cpu[1]), 1)
+            self._last_cpu = (busy, total)
+            used, available = _read_meminfo()
+            sample['mem_used_mb'] = round(used, 1)
+            sample['mem_avail_mb'] = round(available, 1)
+            pid = os.getpid()
+            rss = {p: _proc_rss(p) for p in [pid] + _proc_children(pid)}
+            disk = _read_diskstats()
+
+        rss = {p: round(v, 1) for p, v in rss.items() if v is not None}
+        sample['rss_mb'] = rss.get(os.getpid())
+        sample['children_rss_mb'] = round(sum(v for p, v in rss.items() if p != os.getpid()), 1)
+        sample['processes'] = len(rss)
+        if disk:
+            if self._last_disk:
+                elapsed = max(now - self._last_disk[0], 1e-3)
+                sample['disk_read_mbps'] = round((disk[0] - self._last_disk[1][0]) / elapsed / (1 << 20), 2)
+                sample['disk_write_mbps'] = round((disk[1] - self._last_disk[1][1]) / elapsed / (1 << 20), 2)
+            self._last_disk = (now, disk)
+        return sample
+
+    def sample_slow(self):
+        """One sample of container stats and GPU utilisation"""
+        sample = {'t': round(time.time(), 2), 'kind': 'slow'}
+        if self.containers:
+            try:
+                result = subprocess.run(['docker', 'stats', '--no-stream', '--format', '{{json .}}'] + self.containers,
+                                        capture_output=True, text=True, timeout=self.command_timeout)
+            except subprocess.TimeoutExpired:
+                result = None  # busy docker daemon, skip this sample
+            containers = {}
+            for line in result.stdout.splitlines() if result else []:
+                try:
+                    stats = json.loads(line)
+                except ValueError:
+                    continue
+                containers[stats.get('Name', stats.get('Container'))] = {
+                    'cpu_pct': _parse_size(stats.get('CPUPerc', '').rstrip('%')),
+                    'mem_mb': _parse_size(stats.get('MemUsage', '').split('/')[0]),
+                }
+            sample['containers'] = containers
+        if self.gpu:
+            try:
+                result = subprocess.run(['nvidia-smi', '--query-gpu=utilization.gpu,memory.used',
+                                         '--format=csv,noheader,nounits'], capture_output=True, text=True,
+                                        timeout=self.command_timeout)
+            except subprocess.TimeoutExpired:
+                result = None
+            gpus = []
+            for line in result.stdout.splitlines() if result else []:
+                try:
+                    utilisation, memory = (float(v) for v in line.split(','))
+                except ValueError:
+                    continue
+                gpus.append({'util_pct': utilisation, 'mem_mb': memory})
+            sample['gpus'] = gpus
+        return sample
+
+    def _window_summary(self, samples):
+        """Averages and peaks over a list of samples"""
+        host = [s for s in samples if s['kind'] == 'host']
+        slow = [s for s in samples if s['kind'] == 'slow']
+
+        def stats(values):
+            values = [v for v in values if v is not None]
+            if not values:
+                return None
+            return {'mean': round(sum(values) / len(values), 1), 'max': round(max(values), 1)}
+
+        summary = {
+            'samples': len(host),
+            'cpu_pct': stats(s.get('cpu_pct') for s in host),
+            'rss_mb': stats(s.get('rss_mb') for s in host),
+            'children_rss_mb': stats(s.get('children_rss_mb') for s in host),
+            'mem_used_mb': stats(s.get('mem_used_mb') for s in host),
+            'disk_read_mbps': stats(s.get('disk_read_mbps') for s in host),
+            'disk_write_mbps': stats(s.get('disk_write_mbps') for s in host),
+        }
+        names = {name for s in slow for name in s.get('containers', {})}
+        for name in sorted(names):
+            summary[f'container:{name}'] = {
+                'cpu_pct': stats(s['containers'].get(name, {}).get('cpu_pct') for s in slow if 'containers' in s),
+                'mem_mb': stats(s['containers'].get(name, {}).get('mem_mb') for s in slow if 'containers' in s),
+            }
+        gpu_samples = [g for s in slow for g in s.get('gpus', [])]
+        if gpu_samples:
+            summary['gpu_util_pct'] = stats(g['util_pct'] for g in gpu_samples)
+            summary['gpu_mem_mb'] = stats(g['mem_mb'] for g in gpu_samples)
+        return summary
+
+    def report(self, output_path=None):
+        """Whole-run and per-stage resource summary, written as JSON when output_path is set"""
+        with self._lock:
+            samples = list(self.samples)
+        report = {'run': self._window_summary(samples), 'stages': []}
+        for stage in self.stages:
+            start = stage['started']
+            end = start + stage['wall_s']
+            window = [s for s in samples if start <= s['t'] <= end]
+            entry = {'stage': stage['stage'], 'wall_s': stage['wall_s'], 'cpu_s': stage['cpu_s']}
+            entry.update(self._window_summary(window))
+            report['stages'].append(entry)
+
+        if output_path:
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(output_path, 'w') as f:
+                json.dump(report, f, indent=1)
+        return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record resource usage while a command runs")
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--container', action='append', default=[], help="docker container to sample")
+    parser.add_argument('--output', default='telemetry.jsonl')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help="command to run, e.g. python main.py")
+    args = parser.parse_args()
+
+    sampler = ResourceSampler(args.interval, args.output, containers=args.container)
+    with sampler:
+        subprocess.run(args.command)
+    report = sampler.report(Path(args.output).with_suffix('.summary.json'))
+    print(json.dumps(report['run'], indent=1))
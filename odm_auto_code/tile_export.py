@@ -0,0 +1,242 @@
+import os
+import cv2
+import json
+import math
+import shutil
+import subprocess
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from compositor import TiledCanvas
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:  # orthophotos are then decoded whole with OpenCV
+    rasterio = None
+
+
+class ArraySource:
+    """Region reader over an in-memory BGR(A) mosaic, regions are views"""
+
+    def __init__(self, image):
+        self.image = image
+        self.height, self.width = image.shape[:2]
+        self.channels = image.shape[2] if image.ndim == 3 else 1
+
+    def read_region(self, x0, y0, x1, y1):
+        return self.image[y0:y1, x0:x1]
+
+    def close(self):
+        pass
+
+
+class CanvasSource(ArraySource):
+    """Region reader over a disk-backed TiledCanvas"""
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.width, self.height, self.channels = canvas.width, canvas.height, canvas.channels
+
+    def read_region(self, x0, y0, x1, y1):
+        return self.canvas.read_region(x0, y0, x1, y1)
+
+
+class RasterSource(ArraySource):
+    """Windowed reader over a GeoTIFF such as ODM's orthophoto, returning BGR(A)"""
+
+    def __init__(self, path):
+        self.dataset = rasterio.open(path)
+        self.width, self.height = self.dataset.width, self.dataset.height
+        self.channels = min(self.dataset.count, 4)
+        self._lock = threading.Lock()  # GDAL datasets must not be read from several threads at once
+
+    def read_region(self, x0, y0, x1, y1):
+        with self._lock:
+            bands = self.dataset.read(list(range(1, self.channels + 1)), window=Window(x0, y0, x1 - x0, y1 - y0))
+        region = np.moveaxis(bands, 0, -1)
+        if region.dtype == np.uint16:
+            region = (region >> 8).astype(np.uint8)
+        elif region.dtype != np.uint8:
+            region = np.clip(region, 0, 255).astype(np.uint8)
+        if self.channels >= 3:
+            region = region[..., [2, 1, 0] + ([3] if self.channels == 4 else [])]  # RGB(A) to BGR(A)
+        return np.ascontiguousarray(region)
+
+    def close(self):
+        self.dataset.close()
+
+
+def open_source(source):
+    """Region reader for an array, a TiledCanvas or an image/GeoTIFF path"""
+    if isinstance(source, TiledCanvas):
+        return CanvasSource(source)
+    if isinstance(source, np.ndarray):
+        return ArraySource(source)
+    if rasterio is not None and str(source).lower().endswith(('.tif', '.tiff')):
+        return RasterSource(source)
+    image = cv2.imread(str(source), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(f"Cannot read {source}")
+    return ArraySource(image)
+
+
+class TileExporter:
+    """Write a mosaic as a multi-resolution tile pyramid, {zoom}/{x}/{y}.{format}
+
+    Tiles use a pixel (non-geographic) grid: the highest zoom holds the mosaic at full
+    resolution and every lower zoom halves it, as for Leaflet's CRS.Simple or gdal2tiles'
+    raster profile. The pyramid is built depth first, each parent from its four children,
+    so only a few tiles per worker are ever in memory and the source is read once. Subtrees
+    are encoded in parallel threads (OpenCV releases the GIL). Fully empty tiles, such as
+    the black borders around a mosaic, are not written.
+    """
+
+    def __init__(self, tile_size=256, image_format='png', quality=90, scheme='xyz', workers=None):
+        self.tile_size = tile_size
+        self.image_format = image_format  # 'png' keeps the alpha of orthophotos, 'jpg' is smaller
+        self.quality = quality
+        self.scheme = scheme  # 'xyz' counts rows from the top, 'tms' from the bottom
+        self.workers = workers or os.cpu_count() or 1
+
+    def max_zoom(self, width, height):
+        return max(0, math.ceil(math.log2(max(width, height) / self.tile_size)))
+
+    def grid(self, width, height, zoom, max_zoom):
+        """(columns, rows) of tiles at zoom"""
+        scale = 2 ** (zoom - max_zoom)
+        return (max(1, math.ceil(width * scale / self.tile_size)),
+                max(1, math.ceil(height * scale / self.tile_size)))
+
+    def _encode_params(self):
+        if self.image_format in ('jpg', 'jpeg'):
+            return [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        if self.image_format == 'webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return [cv2.IMWRITE_PNG_COMPRESSION, 3]
+
+    def _write(self, output_dir, zoom, x, y, rows, tile):
+        """Encode one tile unless it is empty"""
+        if tile.shape[2] == 4:
+            empty = not tile[..., 3].any()
+            if self.image_format in ('jpg', 'jpeg'):
+                tile = cv2.cvtColor(tile, cv2.COLOR_BGRA2BGR)
+        else:
+            empty = not tile.any()
+        if empty:
+            return
+        if self.scheme == 'tms':
+            y = rows - 1 - y
+        folder = output_dir / str(zoom) / str(x)
+        folder.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(folder / f"{y}.{self.image_format}"), tile, self._encode_params())
+
+    def _render(self, source, output_dir, zoom, x, y, max_zoom):
+        """Write tile (zoom, x, y) and everything below it, returns the tile image"""
+        ts = self.tile_size
+        columns, rows = self.grid(source.width, source.height, zoom, max_zoom)
+        tile = np.zeros((ts, ts, source.channels), dtype=np.uint8)
+        if zoom == max_zoom:
+            x0, y0 = x * ts, y * ts
+            x1, y1 = min(x0 + ts, source.width), min(y0 + ts, source.height)
+            region = source.read_region(x0, y0, x1, y1)
+            tile[:y1 - y0, :x1 - x0] = region.reshape(y1 - y0, x1 - x0, -1)
+        else:
+            child_columns, child_rows = self.grid(source.width, source.height, zoom + 1, max_zoom)
+            children = np.zeros((2 * ts, 2 * ts, source.channels), dtype=np.uint8)
+            for dy in (0, 1):
+                for dx in (0, 1):
+                    cx, cy = 2 * x + dx, 2 * y + dy
+                    if cx < child_columns and cy < child_rows:
+                        children[dy * ts:(dy + 1) * ts, dx * ts:(dx + 1) * ts] = \
+                            self._render(source, output_dir, zoom + 1, cx, cy, max_zoom)
+            tile[:] = cv2.resize(children, (ts, ts), interpolation=cv2.INTER_AREA).reshape(tile.shape)
+        self._write(output_dir, zoom, x, y, rows, tile)
+        return tile
+
+    def export(self, source, output_dir, min_zoom=0):
+        """Write the pyramid for an array, TiledCanvas or image path; returns its metadata"""
+        output_dir = Path(output_dir)
+        reader = open_source(source)
+        try:
+            max_zoom = self.max_zoom(reader.width, reader.height)
+            # Hand whole subtrees to the workers from the first zoom with enough tiles to go round
+            split_zoom = max_zoom
+            for zoom in range(min_zoom, max_zoom + 1):
+                columns, rows = self.grid(reader.width, reader.height, zoom, max_zoom)
+                if columns * rows >= 2 * self.workers:
+                    split_zoom = zoom
+                    break
+            columns, rows = self.grid(reader.width, reader.height, split_zoom, max_zoom)
+            jobs = [(x, y) for y in range(rows) for x in range(columns)]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                tiles = list(executor.map(lambda job: self._render(reader, output_dir, split_zoom, *job, max_zoom),
+                                          jobs))
+            level = dict(zip(jobs, tiles))
+
+            # The few tiles above the split are built from the level below in memory
+            ts = self.tile_size
+            for zoom in range(split_zoom - 1, min_zoom - 1, -1):
+                columns, rows = self.grid(reader.width, reader.height, zoom, max_zoom)
+                parents = {}
+                for y in range(rows):
+                    for x in range(columns):
+                        children = np.zeros((2 * ts, 2 * ts, reader.channels), dtype=np.uint8)
+                        for dy in (0, 1):
+                            for dx in (0, 1):
+                                child = level.get((2 * x + dx, 2 * y + dy))
+                                if child is not None:
+                                    children[dy * ts:(dy + 1) * ts, dx * ts:(dx + 1) * ts] = child
+                        tile = cv2.resize(children, (ts, ts), interpolation=cv2.INTER_AREA)
+                        tile = tile.reshape(ts, ts, reader.channels)
+                        self._write(output_dir, zoom, x, y, rows, tile)
+                        parents[(x, y)] = tile
+                level = parents
+
+            metadata = {'width': reader.width, 'height': reader.height, 'tile_size': ts, 'min_zoom': min_zoom,
+                        'max_zoom': max_zoom, 'format': self.image_format, 'scheme': self.scheme,
+                        'url': f"{{z}}/{{x}}/{{y}}.{self.image_format}"}
+        finally:
+            reader.close()
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with open(output_dir / 'tiles.json', 'w') as f:
+            json.dump(metadata, f, indent=1)
+        print(f"Wrote zoom {min_zoom}-{max_zoom} tile pyramid to {output_dir}")
+        return metadata
+
+    def export_orthophoto(self, orthophoto_path, output_dir):
+        """Web-mercator XYZ tiles of a georeferenced orthophoto with gdal2tiles, when GDAL is installed
+
+        Without GDAL the orthophoto is tiled on the pixel grid like a stitched mosaic.
+        """
+        gdal2tiles = shutil.which('gdal2tiles.py') or shutil.which('gdal2tiles')
+        if gdal2tiles is None:
+            print("gdal2tiles not found, writing pixel-grid tiles instead of web-mercator tiles")
+            return self.export(orthophoto_path, output_dir)
+        command = [gdal2tiles, f'--processes={self.workers}', '--webviewer=none', f'--tilesize={self.tile_size}',
+                   '--xyz' if self.scheme == 'xyz' else '--profile=mercator', str(orthophoto_path), str(output_dir)]
+        if self.image_format == 'webp':
+            command.insert(1, '--tiledriver=WEBP')
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        print(f"Wrote web-mercator tiles of {orthophoto_path} to {output_dir}")
+        return {'format': self.image_format if self.image_format == 'webp' else 'png', 'scheme': self.scheme}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export a mosaic or ODM orthophoto as a tile pyramid")
+    parser.add_argument('source', help="stitched mosaic image or odm_orthophoto.tif")
+    parser.add_argument('output', help="folder for the {z}/{x}/{y} tiles")
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--format', default='png', choices=['png', 'jpg', 'webp'])
+    parser.add_argument('--tms', action='store_true', help="number rows from the bottom")
+    parser.add_argument('--geo', action='store_true', help="web-mercator tiles of a GeoTIFF through gdal2tiles")
+    args = parser.parse_args()
+
+    exporter = TileExporter(args.tile_size, args.format, scheme='tms' if args.tms else 'xyz')
+    if args.geo:
+        exporter.export_orthophoto(args.source, args.output)
+    else:
+        exporter.export(args.source, args.output)
@@ -0,0 +1,198 @@
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import StageRecorder
+from tile_export import open_source
+
+
+def tile_origins(length, tile_size, overlap):
+    """Start offsets covering [0, length) with overlapping tiles, the last one shifted inward"""
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)  # full-size edge tile instead of a padded one
+    return origins
+
+
+def nms(boxes, scores, iou_threshold=0.5):
+    """Indices of boxes (x1, y1, x2, y2) kept by greedy non-maximum suppression"""
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while len(order):
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        iou = w * h / np.maximum(areas[i] + areas[rest] - w * h, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class TileInference:
+    """Run a detector over a mosaic in overlapping, detector-sized tiles
+
+    Tiles are views into the mosaic (copied only when it is a disk-backed canvas or an
+    orthophoto read in windows), and tiles that are mostly empty, like the black borders
+    around a stitched mosaic, are skipped. The rest are packed into fixed-size batches for
+    `model`, any callable taking an (N, H, W, 3) uint8 batch and returning, per image, an
+    (M, 6) array of x1, y1, x2, y2, score, class in tile pixels. Detections are shifted to
+    mosaic pixels and merged across tiles with class-wise NMS. Boxes cut by an inner tile
+    edge are dropped, the overlap guarantees the neighbouring tile sees those objects whole.
+    """
+
+    def __init__(self, model, tile_size=1280, overlap=160, batch_size=8, min_content=0.05, score_threshold=0.25,
+                 iou_threshold=0.5, rgb=True, pad_batches=True, edge_margin=2, recorder=None):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap  # should exceed the largest object in pixels
+        self.batch_size = batch_size
+        self.min_content = min_content  # fraction of non-empty pixels for a tile to be worth running
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.rgb = rgb  # mosaics are BGR, most detectors expect RGB
+        self.pad_batches = pad_batches  # keep every batch at batch_size for fixed-shape engines
+        self.edge_margin = edge_margin
+        self.recorder = recorder or StageRecorder()
+
+    def content(self, tile):
+        """Fraction of non-empty pixels, sampled on a sparse grid"""
+        sample = tile[::8, ::8]
+        if sample.ndim == 3 and sample.shape[2] == 4:
+            return float(np.count_nonzero(sample[..., 3])) / sample[..., 3].size
+        filled = sample.any(axis=2) if sample.ndim == 3 else sample > 0
+        return float(np.count_nonzero(filled)) / filled.size
+
+    def tiles(self, reader):
+        """Yield (x, y, tile) for every tile with enough content"""
+        for y in tile_origins(reader.height, self.tile_size, self.overlap):
+            for x in tile_origins(reader.width, self.tile_size, self.overlap):
+                tile = reader.read_region(x, y, min(x + self.tile_size, reader.width),
+                                          min(y + self.tile_size, reader.height))
+                if self.content(tile) >= self.min_content:
+                    yield x, y, tile
+
+    def batches(self, reader):
+        """Yield (origins, batch) with up to batch_size tiles, padded to tile_size where the mosaic is smaller"""
+        origins = []
+        batch = np.zeros((self.batch_size, self.tile_size, self.tile_size, 3), dtype=np.uint8)
+        for x, y, tile in self.tiles(reader):
+            h, w = tile.shape[:2]
+            # the one copy per tile: channel order and alpha are handled while filling the batch
+            if tile.ndim == 2:
+                batch[len(origins), :h, :w] = tile[..., None]
+            else:
+                batch[len(origins), :h, :w] = tile[..., 2::-1] if self.rgb else tile[..., :3]
+            origins.append((x, y))
+            if len(origins) == self.batch_size:
+                yield origins, batch
+                origins = []
+                batch = np.zeros_like(batch)
+        if origins:
+            yield origins, batch if self.pad_batches else batch[:len(origins)]
+
+    def to_mosaic(self, detections, x, y, width, height):
+        """Shift tile detections to mosaic pixels, dropping weak boxes and boxes cut by inner tile edges"""
+        detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+        detections = detections[detections[:, 4] >= self.score_threshold]
+        m = self.edge_margin
+        x2_edge, y2_edge = min(self.tile_size, width - x), min(self.tile_size, height - y)
+        cut = (((detections[:, 0] <= m) & (x > 0)) |
+               ((detections[:, 1] <= m) & (y > 0)) |
+               ((detections[:, 2] >= x2_edge - m) & (x + x2_edge < width)) |
+               ((detections[:, 3] >= y2_edge - m) & (y + y2_edge < height)))
+        detections = detections[~cut]
+        detections[:, [0, 2]] += x
+        detections[:, [1, 3]] += y
+        return detections
+
+    def merge(self, detections):
+        """Class-wise NMS over detections from every tile"""
+        if not len(detections):
+            return detections
+        kept = []
+        for cls in np.unique(detections[:, 5]):
+            same = detections[detections[:, 5] == cls]
+            kept.append(same[nms(same[:, :4], same[:, 4], self.iou_threshold)])
+        merged = np.concatenate(kept)
+        return merged[np.argsort(-merged[:, 4])]
+
+    def run(self, source):
+        """(N, 6) detections in mosaic pixels for an array, TiledCanvas or orthophoto path"""
+        reader = open_source(source)
+        found = []
+        try:
+            with self.recorder.stage('inference', tile_size=self.tile_size) as info:
+                tiles = 0
+                # Fill the next batch on a thread while the model runs on the current one
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    batches = self.batches(reader)
+                    pending = executor.submit(next, batches, None)
+                    while True:
+                        item = pending.result()
+                        if item is None:
+                            break
+                        pending = executor.submit(next, batches, None)
+                        origins, batch = item
+                        outputs = self.model(batch)
+                        for (x, y), detections in zip(origins, outputs):
+                            found.append(self.to_mosaic(detections, x, y, reader.width, reader.height))
+                        tiles += len(origins)
+                detections = self.merge(np.concatenate(found) if found else np.zeros((0, 6), np.float32))
+                info.update(tiles=tiles, detections=len(detections))
+        finally:
+            reader.close()
+        print(f"{len(detections)} detections from {tiles} tiles")
+        return detections
+
+
+def blob_model(batch, min_area=50):
+    """CPU stand-in detector: saturated colour blobs (ODLC targets on grass or tarmac) as boxes"""
+    outputs = []
+    for image in batch:
+        saturation = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)[..., 1]
+        mask = cv2.threshold(saturation, 120, 255, cv2.THRESH_BINARY)[1]
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        boxes = [(x, y, x + w, y + h, min(1.0, area / (w * h)), 0)
+                 for x, y, w, h, area in stats[1:count] if area >= min_area]
+        outputs.append(np.array(boxes, dtype=np.float32).reshape(-1, 6))
+    return outputs
+
+
+def yolo_model(weights, imgsz=1280, device=None):
+    """Callable wrapping an ultralytics YOLO model for TileInference"""
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+
+    def predict(batch):
+        results = model.predict(list(batch), imgsz=imgsz, device=device, verbose=False)
+        return [np.hstack([r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy()[:, None],
+                           r.boxes.cls.cpu().numpy()[:, None]]) for r in results]
+    return predict
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Detect objects on a stitched mosaic or orthophoto tile by tile")
+    parser.add_argument('source', help="mosaic image or odm_orthophoto.tif")
+    parser.add_argument('--weights', help="YOLO weights, the CPU blob detector is used when omitted")
+    parser.add_argument('--tile-size', type=int, default=1280)
+    parser.add_argument('--overlap', type=int, default=160)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--output', default='detections.json')
+    args = parser.parse_args()
+
+    model = yolo_model(args.weights, args.tile_size) if args.weights else blob_model
+    # ultralytics converts images itself and expects BGR like OpenCV
+    runner = TileInference(model, args.tile_size, args.overlap, args.batch_size, rgb=not args.weights,
+                           recorder=StageRecorder(verbose=True))
+    detections = runner.run(args.source)
+    with open(args.output, 'w') as f:
+        json.dump([{'box': [round(float(v), 1) for v in d[:4]], 'score': round(float(d[4]), 3), 'class': int(d[5])}
+                   for d in detections], f, indent=1)
+    print(f"Detections written to {args.output}")
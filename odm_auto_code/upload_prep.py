@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image
+from gps_index import read_gps
+
+EXIF_IFD = 0x8769
+FOCAL_LENGTH_35MM = 0xA405
+
+
+def ground_sample_distance(img, altitude):
+    """Ground sample distance in cm/px from the 35mm-equivalent focal length, None if unknown"""
+    focal_35mm = img.getexif().get_ifd(EXIF_IFD).get(FOCAL_LENGTH_35MM)
+    if not focal_35mm or not altitude or altitude <= 0:
+        return None
+    # A 35mm frame is 36mm wide, so the footprint width is altitude * 36 / focal length
+    return altitude * 100 * 36.0 / (float(focal_35mm) * max(img.size))
+
+
+def _prepare_one(args):
+    """Downscale one image, keeping EXIF/GPS and XMP
+
+    Returns the path to upload and whether the GSD could be worked out (True when no
+    target_gsd is set). The original is uploaded instead when the image cannot be prepared.
+    """
+    src, dst, max_size, target_gsd, flight_height, ground_elevation, quality = args
+    try:
+        return _downscale(src, dst, max_size, target_gsd, flight_height, ground_elevation, quality)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not prepare {Path(src).name} ({e}), uploading the original")
+        return src, True
+
+
+def _downscale(src, dst, max_size, target_gsd, flight_height, ground_elevation, quality):
+    with Image.open(src) as img:
+        scale = 1.0
+        if max_size and max(img.size) > max_size:
+            scale = max_size / max(img.size)
+        gsd = None
+        if target_gsd:
+            # Only a height above ground gives the footprint, the GPS altitude is above sea level
+            position = read_gps(src, ground_elevation)
+            height = position[2] if position and position[2] is not None else flight_height
+            gsd = ground_sample_distance(img, height)
+            if gsd:
+                scale = min(scale, gsd / target_gsd)
+        known = gsd is not None or not target_gsd
+        if scale >= 0.98:
+            return src, known  # not worth a lossy re-encode
+
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        resized = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        if resized.mode not in ('RGB', 'L', 'CMYK'):
+            resized = resized.convert('RGB')  # JPEG has no alpha or palette, e.g. RGBA PNGs
+        extra = {key: img.info[key] for key in ('exif', 'icc_profile', 'xmp') if img.info.get(key)}
+        resized.save(dst, 'JPEG', quality=quality, **extra)
+    return dst, known
+
+
+def _upload_names(image_paths):
+    """Unique .jpg names for the prepared images, so a.jpg and a.png do not collide on the node"""
+    originals = {Path(p).name.lower() for p in image_paths}
+    names, used = [], set()
+    for p in image_paths:
+        stem, k = Path(p).stem, 1
+        name = f"{stem}.jpg"
+        # an original uploaded untouched keeps its name, so prepared images must not take it
+        while name.lower() in used or (name.lower() in originals and name.lower() != Path(p).name.lower()):
+            name = f"{stem}_{k}.jpg"
+            k += 1
+        used.add(name.lower())
+        names.append(name)
+    return names
+
+
+class UploadPreparer:
+    """Downscale and re-encode images in a process pool before they are uploaded to NodeODM
+
+    Images are capped at max_size pixels on the long side and/or at target_gsd cm/px, which
+    needs the 35mm focal length from EXIF and the height above ground. That is the DJI relative
+    altitude when the image has one, else its GPS altitude less ground_elevation (meters above
+    sea level), else flight_height (meters). Images with none of these are not scaled for GSD.
+    Images already small enough are uploaded untouched.
+    """
+
+    def __init__(self, max_size=None, target_gsd=None, quality=90, workers=None, output_folder=None,
+                 flight_height=None, ground_elevation=None):
+        self.max_size = max_size
+        self.target_gsd = target_gsd
+        self.flight_height = flight_height
+        self.ground_elevation = ground_elevation
+        self.quality = quality
+        self.workers = workers or os.cpu_count() or 1
+        self.output_folder = Path(output_folder) if output_folder else None
+        self._temp_folder = None
+
+    @property
+    def enabled(self):
+        return bool(self.max_size or self.target_gsd)
+
+    def settings(self):
+        """Parameters that change the uploaded pixels, for use in cache keys"""
+        return {'max_size': self.max_size, 'target_gsd': self.target_gsd, 'flight_height': self.flight_height,
+                'ground_elevation': self.ground_elevation, 'quality': self.quality}
+
+    def prepare(self, image_paths):
+        """Paths to upload in the same order as image_paths"""
+        if not self.enabled:
+            return list(image_paths)
+        output_folder = self.output_folder
+        if output_folder is None:
+            self._temp_folder = output_folder = Path(tempfile.mkdtemp(prefix='odm_upload_'))
+        output_folder.mkdir(parents=True, exist_ok=True)
+
+        jobs = [(p, str(output_folder / name), self.max_size, self.target_gsd, self.flight_height,
+                 self.ground_elevation, self.quality)
+                for p, name in zip(image_paths, _upload_names(image_paths))]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(_prepare_one, jobs, chunksize=max(1, len(jobs) // (4 * self.workers))))
+        prepared = [path for path, _ in results]
+        unknown = sum(1 for _, known in results if not known)
+        if unknown:
+            print(f"Warning: no height above ground or focal length for {unknown} image(s), "
+                  f"they were not scaled to {self.target_gsd} cm/px; set flight_height or ground_elevation")
+        resized = sum(1 for src, dst in zip(image_paths, prepared) if src != dst)
+        print(f"Prepared {len(prepared)} images for upload ({resized} downscaled)")
+        return prepared
+
+    def cleanup(self):
+        """Remove the temporary folder of prepared images, if one was created"""
+        if self._temp_folder is not None:
+            shutil.rmtree(self._temp_folder, ignore_errors=True)
+            self._temp_folder = None